@@ -1,15 +1,55 @@
 import os
 import sys
+import bisect
 import calendar
+import click
+import cProfile
+import gzip
+import hashlib
+import heapq
+import json
+import mimetypes
+import pstats
+import random
+import re
+import smtplib
+import sqlite3
+import threading
+import time
+import zlib
 from datetime import datetime, date, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from email.message import EmailMessage
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, g
+from flask import before_render_template, template_rendered, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import is_resource_modified
 from dotenv import load_dotenv
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
 from functools import wraps
 from reportlab.lib.units import inch
+from collections import Counter, OrderedDict
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 # Load environment variables
 load_dotenv()
 
@@ -27,6 +67,100 @@ app.config['ANNUAL_LEAVE_DAYS'] = 12
 app.config['SICK_LEAVE_DAYS'] = 10
 app.config['CASUAL_LEAVE_DAYS'] = 7
 app.config['EMERGENCY_LEAVE_DAYS'] = 5
+# Unused days that may be carried into the next leave year (calendar year)
+app.config['LEAVE_CARRY_FORWARD_CAPS'] = {'Annual': 6, 'Sick': 0, 'Casual': 0, 'Emergency': 0}
+
+# Attendance archival: current + previous year stay in the live table
+app.config['ATTENDANCE_ARCHIVE_DIR'] = os.path.join(BASE_DIR, 'archive')
+app.config['ATTENDANCE_HOT_YEARS'] = 2
+
+# Leave PDF exports stop after this many rows (CSV has no cap)
+app.config['PDF_EXPORT_MAX_ROWS'] = 20000
+
+# Overtime is paid in whole blocks of this many minutes beyond the shift
+app.config['OVERTIME_ROUNDING_MINUTES'] = 30
+
+# Compiled templates are shared across workers through this directory;
+# rendered fragments are cached per worker, least recently used first out
+app.config['TEMPLATE_CACHE_DIR'] = os.path.join(BASE_DIR, 'cache', 'jinja')
+app.config['FRAGMENT_CACHE_SIZE'] = 5000
+
+# Text responses at least this large are gzip/brotli compressed on the fly
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 4
+
+# Leave notifications are queued in the outbox table and sent by a background
+# dispatcher. For local testing run an SMTP stand-in with:
+#   python -m aiosmtpd -n -l localhost:8025
+app.config['NOTIFICATION_TRANSPORT'] = os.environ.get('NOTIFICATION_TRANSPORT', 'smtp')
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 8025))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '0') == '1'
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'hr@textile.com')
+app.config['NOTIFICATION_BATCH_SIZE'] = 100
+app.config['NOTIFICATION_MAX_ATTEMPTS'] = 6
+app.config['NOTIFICATION_RETRY_BASE_SECONDS'] = 30
+app.config['NOTIFICATION_POLL_SECONDS'] = 10
+
+# Reports and exports read a periodically refreshed copy of the database
+# (SQLite online backup) so long scans don't hold up attendance/leave writes
+app.config['REPORTING_SNAPSHOT_ENABLED'] = os.environ.get('REPORTING_SNAPSHOT', '1') == '1'
+app.config['REPORTING_SNAPSHOT_PATH'] = os.path.join(BASE_DIR, 'cache', 'reporting_snapshot.db')
+app.config['REPORTING_SNAPSHOT_MAX_AGE'] = 300
+
+# Bulk onboarding. Each temporary password gets a full-strength hash (~0.35 s),
+# so the browser import takes small sheets only and larger ones go through
+# `flask import-employees`, which hashes in a pool of ONBOARDING_HASH_WORKERS
+# processes started for that import and reports progress.
+app.config['ONBOARDING_WEB_MAX_ROWS'] = 25
+app.config['ONBOARDING_HASH_WORKERS'] = os.cpu_count() or 1
+app.config['ONBOARDING_CHUNK_SIZE'] = 500
+
+# Approved leaves as iCalendar feeds: leaves ending up to this many days ago
+# are included, and calendar apps may reuse a feed for CALENDAR_FEED_MAX_AGE
+app.config['CALENDAR_FEED_PAST_DAYS'] = 90
+app.config['CALENDAR_FEED_MAX_AGE'] = 300
+
+# Request profiling: a fraction of all requests, or any admin request sent with
+# "X-Profile: cprofile|sampling" or "?_profile=cprofile|sampling"
+app.config['PROFILE_DIR'] = os.path.join(BASE_DIR, 'cache', 'profiles')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_DEFAULT_MODE'] = 'sampling'
+app.config['PROFILE_SAMPLE_INTERVAL'] = 0.005
+app.config['PROFILE_MAX_FILES'] = 200
+
+# One database per mill (site). LMS_SITES="main=textile_lms.db,north=north_mill.db";
+# the first site uses SQLALCHEMY_DATABASE_URI, the others get their own bind.
+# CLI jobs act on the site named by LMS_SITE (default: the first site).
+app.config['SITES'] = dict(
+    entry.strip().split('=', 1) for entry in os.environ.get('LMS_SITES', 'main=textile_lms.db').split(',')
+)
+app.config['DEFAULT_SITE'] = next(iter(app.config['SITES']))
+
+
+def reporting_snapshot_path(site):
+    if site == app.config['DEFAULT_SITE']:
+        return app.config['REPORTING_SNAPSHOT_PATH']
+    stem, extension = os.path.splitext(app.config['REPORTING_SNAPSHOT_PATH'])
+    return f'{stem}_{site}{extension}'
+
+
+def site_bind_key(site, reporting=False):
+    """Bind key for a site's live database (None for the default site) or its snapshot"""
+    if reporting:
+        return 'reporting' if site == app.config['DEFAULT_SITE'] else f'reporting:{site}'
+    return None if site == app.config['DEFAULT_SITE'] else f'site:{site}'
+
+
+app.config['SQLALCHEMY_BINDS'] = {}
+for _site, _filename in app.config['SITES'].items():
+    if _site != app.config['DEFAULT_SITE']:
+        app.config['SQLALCHEMY_BINDS'][site_bind_key(_site)] = f'sqlite:///{os.path.join(BASE_DIR, _filename)}'
+    app.config['SQLALCHEMY_BINDS'][site_bind_key(_site, reporting=True)] = \
+        f'sqlite:///file:{reporting_snapshot_path(_site)}?mode=ro&uri=true'
 
 # Print debug info
 print(f"🔧 Base directory: {BASE_DIR}")
@@ -35,7 +169,45 @@ print(f"🔧 Database path: {app.config['SQLALCHEMY_DATABASE_URI']}")
 # Create necessary directories
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-db = SQLAlchemy(app)
+
+
+def current_site():
+    """Site of the logged-in user (set by the user loader or login).
+
+    Outside a request (CLI commands, jobs) LMS_SITE picks the site; requests
+    without a site, e.g. anonymous ones, always use the default site.
+    """
+    if has_app_context() and g.get('site'):
+        return g.site
+    site = None if has_request_context() else os.environ.get('LMS_SITE')
+    return site if site in app.config['SITES'] else app.config['DEFAULT_SITE']
+
+
+class SiteRoutingSession(FlaskSQLAlchemySession):
+    """Routes every statement to the current site's database, and reads to its
+    reporting snapshot while a route has opted in"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        site = current_site()
+        if not self._flushing and has_app_context() and g.get('reporting_snapshot'):
+            is_text_select = isinstance(clause, db.TextClause) and clause.text.lstrip()[:6].upper() == 'SELECT'
+            if getattr(clause, 'is_select', False) or is_text_select:
+                return self._db.engines[site_bind_key(site, reporting=True)]
+        if site != app.config['DEFAULT_SITE']:
+            return self._db.engines[site_bind_key(site)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': SiteRoutingSession})
+
+
+def site_engine(site=None):
+    """Engine of a site's live database (default: the current site)"""
+    return db.engines[site_bind_key(site or current_site())]
+
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
@@ -57,6 +229,13 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incremented on every ORM UPDATE (see bump_user_row_version); keys cached
+    # template fragments. A plain counter, not a version check: overlapping
+    # edits of the same employee are last-write-wins.
+    row_version = db.Column(db.Integer, nullable=False, default=1)
+    # Set by the change-tracking triggers on every insert/update
+    updated_at = db.Column(db.DateTime, nullable=True)
+    change_seq = db.Column(db.Integer, nullable=True, index=True)
 
     # Relationships
     leaves = db.relationship('Leave', foreign_keys='Leave.user_id', backref='applicant', lazy=True)
@@ -78,6 +257,19 @@ class User(UserMixin, db.Model):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
 
+    def get_id(self):
+        # Session ids carry the site so the loader queries the right database
+        site = current_site()
+        return str(self.id) if site == app.config['DEFAULT_SITE'] else f'{site}:{self.id}'
+
+
+@event.listens_for(User, 'before_update')
+def bump_user_row_version(mapper, connection, target):
+    # Collection changes (a new leave, say) also dirty the user; skip those.
+    # Incremented in SQL so overlapping writers never reuse a version.
+    if db.session.is_modified(target, include_collections=False):
+        target.row_version = User.row_version + 1
+
 
 class Leave(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -92,6 +284,13 @@ class Leave(db.Model):
     applied_date = db.Column(db.DateTime, default=datetime.utcnow)
     approved_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     approved_date = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    change_seq = db.Column(db.Integer, nullable=True, index=True)
+    # Concurrent status changes fail with StaleDataError instead of both
+    # moving the leave's days in the balance
+    row_version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {'version_id_col': row_version}
 
 
 class Attendance(db.Model):
@@ -101,9 +300,393 @@ class Attendance(db.Model):
     check_in = db.Column(db.Time, nullable=True)
     check_out = db.Column(db.Time, nullable=True)
     status = db.Column(db.String(20), default='Absent')
+    worked_hours = db.Column(db.Float, default=0)
     overtime_hours = db.Column(db.Float, default=0)
     remarks = db.Column(db.Text, nullable=True)
     recorded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    change_seq = db.Column(db.Integer, nullable=True, index=True)
+
+    __table_args__ = (db.Index('ix_attendance_user_date', 'user_id', 'date'),)
+
+
+class AttendanceBitmap(db.Model):
+    """One employee-month of attendance as a day bitmap per status (bit 0 = day 1)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    late = db.Column(db.Integer, nullable=False, default=0)
+    half_day = db.Column(db.Integer, nullable=False, default=0)
+    on_leave = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'year', 'month'),
+        db.Index('ix_attendance_bitmap_period', 'year', 'month')
+    )
+
+
+class ShiftRoster(db.Model):
+    """A weekday a shift works; employees are rostered through User.shift"""
+    id = db.Column(db.Integer, primary_key=True)
+    shift = db.Column(db.String(20), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+
+    __table_args__ = (db.UniqueConstraint('shift', 'weekday'),)
+
+
+class LeaveBalance(db.Model):
+    """Entitlement and usage for one employee, leave year and leave type"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    leave_year = db.Column(db.Integer, nullable=False)
+    leave_type = db.Column(db.String(50), nullable=False)
+    accrued = db.Column(db.Float, nullable=False, default=0)
+    carried_forward = db.Column(db.Float, nullable=False, default=0)
+    # Days of approved and of pending leaves starting in the year; moved by
+    # reserve_leave_days() and transfer_leave_days() in the leave's transaction
+    taken = db.Column(db.Float, nullable=False, default=0)
+    reserved = db.Column(db.Float, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'leave_year', 'leave_type'),)
+
+
+class LeaveYearClosing(db.Model):
+    """Progress of close_leave_year(), so an interrupted run resumes"""
+    leave_year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # Highest user id whose next-year balances are committed
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class Notification(db.Model):
+    """Outbox row, committed together with the change it announces"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(40), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_notification_due', 'status', 'next_attempt_at'),)
+
+
+def upgrade_schema():
+    """Add model columns and indexes missing from tables created by older versions.
+
+    db.create_all() only creates missing tables, so columns added to an
+    existing model are appended here with ALTER TABLE.
+    """
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info("{table.name}")'))}
+        if not existing:
+            continue
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = f'{column.name} {column.type.compile(dialect=db.engine.dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                definition += f' DEFAULT {column.default.arg!r}'
+            db.session.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN {definition}'))
+            added.append(f'column {table.name}.{column.name}')
+        for index in table.indexes:
+            existing_indexes = {row[1] for row in db.session.execute(db.text(f'PRAGMA index_list("{table.name}")'))}
+            if index.name not in existing_indexes:
+                index.create(bind=db.session.connection())
+                added.append(f'index {index.name}')
+    db.session.commit()
+    return added
+
+
+# Full-text search index (SQLite FTS5), kept in sync with user/leave by triggers
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS employee_search USING fts5(
+        first_name, last_name, employee_id, designation, phone,
+        content='user', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS leave_search USING fts5(
+        reason, content='leave', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS employee_search_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO employee_search(rowid, first_name, last_name, employee_id, designation, phone)
+        VALUES (new.id, new.first_name, new.last_name, new.employee_id, new.designation, new.phone);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS employee_search_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO employee_search(employee_search, rowid, first_name, last_name, employee_id, designation, phone)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.employee_id, old.designation, old.phone);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS employee_search_au
+    AFTER UPDATE OF first_name, last_name, employee_id, designation, phone ON "user" BEGIN
+        INSERT INTO employee_search(employee_search, rowid, first_name, last_name, employee_id, designation, phone)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.employee_id, old.designation, old.phone);
+        INSERT INTO employee_search(rowid, first_name, last_name, employee_id, designation, phone)
+        VALUES (new.id, new.first_name, new.last_name, new.employee_id, new.designation, new.phone);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leave_search_ai AFTER INSERT ON leave BEGIN
+        INSERT INTO leave_search(rowid, reason) VALUES (new.id, new.reason);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leave_search_ad AFTER DELETE ON leave BEGIN
+        INSERT INTO leave_search(leave_search, rowid, reason) VALUES ('delete', old.id, old.reason);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leave_search_au AFTER UPDATE OF reason ON leave BEGIN
+        INSERT INTO leave_search(leave_search, rowid, reason) VALUES ('delete', old.id, old.reason);
+        INSERT INTO leave_search(rowid, reason) VALUES (new.id, new.reason);
+    END""",
+]
+
+# Per site: missing until first checked, then whether FTS5 search is usable
+_search_index_ready = {}
+
+
+def ensure_search_index():
+    """Create the FTS5 tables and triggers once, backfilling existing rows"""
+    site = current_site()
+    if site in _search_index_ready:
+        return _search_index_ready[site]
+
+    try:
+        existing = db.session.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE name IN ('employee_search', 'leave_search')"
+        )).scalars().all()
+        for statement in SEARCH_INDEX_DDL:
+            db.session.execute(db.text(statement))
+        if 'employee_search' not in existing:
+            db.session.execute(db.text("INSERT INTO employee_search(employee_search) VALUES ('rebuild')"))
+        if 'leave_search' not in existing:
+            db.session.execute(db.text("INSERT INTO leave_search(leave_search) VALUES ('rebuild')"))
+        db.session.commit()
+        _search_index_ready[site] = True
+    except Exception as e:
+        # SQLite built without FTS5 (or another backend): fall back to LIKE
+        db.session.rollback()
+        print(f"⚠️ Full-text search unavailable, using LIKE search: {e}")
+        _search_index_ready[site] = False
+
+    return _search_index_ready[site]
+
+
+# Change tracking for incremental sync: triggers stamp updated_at and a
+# database-wide change sequence on every insert/update, whatever the write
+# path (ORM, bulk updates, INSERT ... SELECT jobs). SQLite has one writer at
+# a time, so sequence order is commit order and a cursor never skips a row.
+CHANGE_TRACKED_TABLES = ['user', 'leave', 'attendance']
+# Microseconds, the way SQLAlchemy stores DateTime in SQLite
+_TRIGGER_NOW = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+def change_tracking_ddl():
+    statements = ["""CREATE TABLE IF NOT EXISTS change_sequence (
+        id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL
+    )""", "INSERT OR IGNORE INTO change_sequence (id, value) VALUES (1, 0)"]
+    for table in CHANGE_TRACKED_TABLES:
+        stamp = f"""
+            UPDATE change_sequence SET value = value + 1 WHERE id = 1;
+            UPDATE "{table}" SET change_seq = (SELECT value FROM change_sequence WHERE id = 1),
+                                 updated_at = {_TRIGGER_NOW}
+            WHERE id = new.id;
+        """
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {table}_changes_ai AFTER INSERT ON "{table}" '
+                          f'BEGIN {stamp} END')
+        # The stamp itself changes change_seq, which the WHEN clause ignores
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {table}_changes_au AFTER UPDATE ON "{table}" '
+                          f'WHEN new.change_seq IS old.change_seq BEGIN {stamp} END')
+    return statements
+
+
+def ensure_change_tracking():
+    """Create the change sequence and triggers, stamping rows written before them"""
+    for statement in change_tracking_ddl():
+        db.session.execute(db.text(statement))
+    stamped = 0
+    for table in CHANGE_TRACKED_TABLES:
+        # The update trigger gives each row its own sequence number
+        stamped += db.session.execute(db.text(
+            f'UPDATE "{table}" SET updated_at = {_TRIGGER_NOW} WHERE change_seq IS NULL'
+        )).rowcount
+    db.session.commit()
+    return stamped
+
+
+def fts_query(term):
+    """Turn free text into an FTS5 prefix query, e.g. 'ravi wea' -> '"ravi"* "wea"*'"""
+    tokens = ''.join(ch if ch.isalnum() else ' ' for ch in term).split()
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def employee_search_subquery(term):
+    """Ranked user ids matching term, as a subquery with id and rank columns"""
+    return db.text("""
+        SELECT rowid AS id, rank FROM employee_search WHERE employee_search MATCH :q
+    """).bindparams(q=fts_query(term)).columns(id=db.Integer, rank=db.Float).subquery()
+
+
+def leave_search_subquery(term):
+    """Ranked leave ids whose employee details or reason match term"""
+    return db.text("""
+        SELECT id, MIN(rank) AS rank FROM (
+            SELECT leave.id AS id, employee_search.rank AS rank
+            FROM employee_search JOIN leave ON leave.user_id = employee_search.rowid
+            WHERE employee_search MATCH :q
+            UNION ALL
+            SELECT rowid AS id, rank FROM leave_search WHERE leave_search MATCH :q
+        ) GROUP BY id
+    """).bindparams(q=fts_query(term)).columns(id=db.Integer, rank=db.Float).subquery()
+
+
+def apply_leave_search(query, term):
+    """Filter a Leave/User join by search term, best matches first"""
+    if not fts_query(term):
+        return query
+
+    if ensure_search_index():
+        results = leave_search_subquery(term)
+        return query.join(results, results.c.id == Leave.id).order_by(results.c.rank)
+
+    search = f'%{term}%'
+    return query.filter(
+        db.or_(
+            User.first_name.ilike(search),
+            User.last_name.ilike(search),
+            User.employee_id.ilike(search),
+            User.designation.ilike(search),
+            User.phone.ilike(search),
+            Leave.reason.ilike(search)
+        )
+    )
+
+
+# Coworker typeahead: in-memory prefix index over active employees
+COWORKER_SEARCH_LIMIT = 10
+# How often a worker checks whether another worker changed users under it
+COWORKER_INDEX_CHECK_SECONDS = 30
+
+
+class CoworkerIndex:
+    """Sorted (key, user id) pairs over names and employee IDs, searched with bisect
+
+    Routes that change users call refresh() so this worker sees the change
+    immediately; other workers notice it through a periodic signature check.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._user_keys = {}
+        self._records = {}
+        self._versions = {}
+        self._checked_at = None
+
+    @staticmethod
+    def _keys_for(user):
+        name = f'{user.first_name} {user.last_name}'.lower()
+        keys = set(name.split())
+        keys.add(name)
+        if user.employee_id:
+            keys.add(user.employee_id.lower())
+        return keys
+
+    def _add(self, user, sort=True):
+        keys = self._keys_for(user)
+        self._user_keys[user.id] = keys
+        self._versions[user.id] = user.row_version
+        self._records[user.id] = {
+            'id': user.id,
+            'employee_id': user.employee_id,
+            'name': user.get_full_name(),
+            'department': user.department,
+            'designation': user.designation,
+            'phone': user.phone,
+            'text': f'{user.employee_id} - {user.get_full_name()} ({user.department})'
+        }
+        for key in keys:
+            if sort:
+                bisect.insort(self._keys, (key, user.id))
+            else:
+                self._keys.append((key, user.id))
+
+    def _remove(self, user_id):
+        for key in self._user_keys.pop(user_id, ()):
+            del self._keys[bisect.bisect_left(self._keys, (key, user_id))]
+        self._records.pop(user_id, None)
+        self._versions.pop(user_id, None)
+
+    @staticmethod
+    def _indexed_users():
+        return User.query.filter(User.is_admin == False, User.is_active == True)
+
+    def rebuild(self):
+        users = self._indexed_users().all()
+        with self._lock:
+            self._keys, self._user_keys, self._records, self._versions = [], {}, {}, {}
+            for user in users:
+                self._add(user, sort=False)
+            self._keys.sort()
+            self._checked_at = time.monotonic()
+
+    def refresh(self, user):
+        """Re-index one user after it was added, edited, activated or deactivated"""
+        with self._lock:
+            if self._checked_at is None:
+                return
+            self._remove(user.id)
+            if user.is_active and not user.is_admin:
+                self._add(user)
+
+    def _ensure_current(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < COWORKER_INDEX_CHECK_SECONDS:
+            return
+        count, versions = self._indexed_users().with_entities(
+            db.func.count(User.id), db.func.coalesce(db.func.sum(User.row_version), 0)
+        ).one()
+        with self._lock:
+            if self._checked_at is not None and (count, versions) == (len(self._versions), sum(self._versions.values())):
+                self._checked_at = time.monotonic()
+                return
+        self.rebuild()
+
+    def search(self, term, limit=COWORKER_SEARCH_LIMIT, exclude_id=None):
+        """Users with a key starting with the first word and matching every other word"""
+        tokens = (term or '').lower().split()
+        if not tokens:
+            return []
+        self._ensure_current()
+
+        first, rest = tokens[0], tokens[1:]
+        matches = []
+        seen = set()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (first,))
+            while position < len(self._keys) and len(matches) < limit:
+                key, user_id = self._keys[position]
+                position += 1
+                if not key.startswith(first):
+                    break
+                if user_id in seen or user_id == exclude_id:
+                    continue
+                seen.add(user_id)
+                user_keys = self._user_keys[user_id]
+                if all(any(k.startswith(token) for k in user_keys) for token in rest):
+                    matches.append(self._records[user_id])
+        return matches
+
+
+_coworker_indexes = {}
+
+
+def site_coworker_index():
+    """The current site's coworker index"""
+    return _coworker_indexes.setdefault(current_site(), CoworkerIndex())
 
 
 # Decorator for admin-only routes
@@ -121,21 +704,698 @@ def admin_required(f):
 
 @login_manager.user_loader
 def load_user(user_id):
+    site, _, user_id = user_id.rpartition(':')
+    if site:
+        if site not in app.config['SITES']:
+            return None
+        g.site = site
     return User.query.get(int(user_id))
 
 
+# Reporting snapshot
+# One lock per site so each snapshot has a single writer
+_reporting_refresh_locks = {site: threading.Lock() for site in app.config['SITES']}
+
+
+def refresh_reporting_snapshot():
+    """Copy the live database into the reporting snapshot with SQLite's backup API.
+
+    The live database is copied into a staging file in small steps so writers
+    get in between, then the staging file replaces the snapshot contents in a
+    single step so readers never see a half-copied snapshot.
+    """
+    site = current_site()
+    snapshot_path = reporting_snapshot_path(site)
+    staging_path = snapshot_path + '.staging'
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+
+    with _reporting_refresh_locks[site]:
+        taken_at = datetime.utcnow()
+        source = sqlite3.connect(site_engine(site).url.database)
+        staging = sqlite3.connect(staging_path)
+        try:
+            source.backup(staging, pages=1024, sleep=0.005)
+            staging.execute('CREATE TABLE IF NOT EXISTS reporting_snapshot_meta (taken_at TEXT NOT NULL)')
+            staging.execute('DELETE FROM reporting_snapshot_meta')
+            staging.execute('INSERT INTO reporting_snapshot_meta (taken_at) VALUES (?)', (taken_at.isoformat(),))
+            staging.commit()
+
+            snapshot = sqlite3.connect(snapshot_path, timeout=30)
+            try:
+                staging.backup(snapshot)
+            finally:
+                snapshot.close()
+        finally:
+            staging.close()
+            source.close()
+            os.remove(staging_path)
+    return taken_at
+
+
+def reporting_snapshot_taken_at():
+    """When the current snapshot was taken (UTC), or None without a snapshot"""
+    site = current_site()
+    if not os.path.exists(reporting_snapshot_path(site)):
+        return None
+    try:
+        with db.engines[site_bind_key(site, reporting=True)].connect() as conn:
+            value = conn.exec_driver_sql('SELECT taken_at FROM reporting_snapshot_meta').scalar()
+    except Exception:
+        return None
+    return datetime.fromisoformat(value) if value else None
+
+
+def _refresh_reporting_snapshot_in_background():
+    site = current_site()
+    if _reporting_refresh_locks[site].locked():
+        return
+
+    def run():
+        with app.app_context():
+            g.site = site
+            try:
+                refresh_reporting_snapshot()
+            except Exception as e:
+                print(f"❌ Reporting snapshot refresh failed: {e}")
+
+    threading.Thread(target=run, name='reporting-snapshot', daemon=True).start()
+
+
+def use_reporting_snapshot():
+    """Send this context's reads to the reporting snapshot; a stale snapshot is
+    refreshed in the background, a missing one synchronously."""
+    if not app.config['REPORTING_SNAPSHOT_ENABLED']:
+        return
+    taken_at = reporting_snapshot_taken_at()
+    if taken_at is None:
+        refresh_reporting_snapshot()
+    elif (datetime.utcnow() - taken_at).total_seconds() > app.config['REPORTING_SNAPSHOT_MAX_AGE']:
+        _refresh_reporting_snapshot_in_background()
+    g.reporting_snapshot = True
+
+
+def reads_reporting_snapshot(f):
+    """Route reads go to the reporting snapshot"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        use_reporting_snapshot()
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+@app.template_global()
+def reporting_snapshot_status():
+    """Snapshot age for the UI, or None when reports read the live database"""
+    if not app.config['REPORTING_SNAPSHOT_ENABLED']:
+        return None
+    taken_at = reporting_snapshot_taken_at()
+    if taken_at is None:
+        return None
+    age_minutes = int((datetime.utcnow() - taken_at).total_seconds() // 60)
+    return {
+        'taken_at': taken_at,
+        'age_minutes': age_minutes,
+        'stale': age_minutes * 60 > app.config['REPORTING_SNAPSHOT_MAX_AGE']
+    }
+
+
+@app.route('/admin/reports/snapshot/refresh', methods=['POST'])
+@login_required
+@admin_required
+def refresh_reporting_snapshot_view():
+    if not app.config['REPORTING_SNAPSHOT_ENABLED']:
+        flash('Reporting snapshot is disabled; reports read live data.', 'info')
+    else:
+        refresh_reporting_snapshot()
+        flash('Reporting snapshot refreshed.', 'success')
+    return redirect(request.referrer or url_for('admin_reports'))
+
+
+@app.cli.command('refresh-reporting-snapshot')
+@click.option('--every', type=int, default=None, help='Keep refreshing every N seconds.')
+def refresh_reporting_snapshot_command(every):
+    """Copy the live database into the reporting snapshot."""
+    while True:
+        started = time.perf_counter()
+        refresh_reporting_snapshot()
+        print(f"✅ Reporting snapshot refreshed in {time.perf_counter() - started:.2f}s")
+        if not every:
+            break
+        time.sleep(every)
+
+
+# Template caching: bytecode on disk, rendered fragments in an LRU
+class CountingBytecodeCache(FileSystemBytecodeCache):
+    """Filesystem bytecode cache that counts hits and misses"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered template fragments"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = render()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache 'name', key, ... %}...{% endcache %}
+
+    The body is rendered once per distinct key, so every value the body
+    depends on (typically an id and row_version) must be part of the key.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.Const(parser.name), nodes.List(key_parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, template_name, key_parts, caller):
+        key = (current_site(), template_name) + tuple(str(part) for part in key_parts)
+        return Markup(fragment_cache.get_or_render(key, lambda: str(caller())))
+
+
+os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+bytecode_cache = CountingBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+app.jinja_env.bytecode_cache = bytecode_cache
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+_template_render_stats = {}
+_template_render_lock = threading.Lock()
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_timers', []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    timers = g.get('template_timers')
+    if not timers:
+        return
+    elapsed_ms = (time.perf_counter() - timers.pop()) * 1000
+    with _template_render_lock:
+        stats = _template_render_stats.setdefault(template.name, {'renders': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['renders'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+
+def template_cache_metrics():
+    with _template_render_lock:
+        templates = {
+            name: {
+                'renders': stats['renders'],
+                'avg_ms': round(stats['total_ms'] / stats['renders'], 2),
+                'max_ms': round(stats['max_ms'], 2)
+            }
+            for name, stats in sorted(_template_render_stats.items())
+        }
+    return {
+        'bytecode_cache': {'hits': bytecode_cache.hits, 'misses': bytecode_cache.misses},
+        'fragment_cache': fragment_cache.stats(),
+        'templates': templates
+    }
+
+
+@app.route('/admin/metrics/templates')
+@login_required
+@admin_required
+def template_metrics():
+    return jsonify(template_cache_metrics())
+
+
+# Static assets: content-hashed copies with precompressed variants, served
+# with far-future immutable caching
+ASSET_SOURCE_FILES = ['css/style.css', 'css/dashboard.css', 'js/main.js', 'logo.png']
+ASSET_COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt')
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+app.config['ASSET_DIST_DIR'] = os.path.join(app.static_folder, 'dist')
+
+_asset_manifest = None
+
+
+def build_assets():
+    """Write hashed copies (plus .gz/.br for text) of the static assets and a manifest"""
+    global _asset_manifest
+    dist_dir = app.config['ASSET_DIST_DIR']
+    manifest = {}
+    for filename in ASSET_SOURCE_FILES:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            content = f.read()
+
+        stem, extension = os.path.splitext(filename)
+        hashed = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+        target = os.path.join(dist_dir, hashed)
+        manifest[filename] = hashed
+        if os.path.exists(target):
+            continue
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        variants = {'': content}
+        if extension in ASSET_COMPRESSIBLE_EXTENSIONS:
+            variants['.gz'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                variants['.br'] = brotli.compress(content, quality=11)
+        # Compressed variants first, so the plain file only appears once they exist
+        for suffix in sorted(variants, reverse=True):
+            with open(target + suffix, 'wb') as f:
+                f.write(variants[suffix])
+
+    manifest_path = os.path.join(dist_dir, 'manifest.json')
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    _asset_manifest = manifest
+    return manifest
+
+
+def load_asset_manifest():
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(os.path.join(app.config['ASSET_DIST_DIR'], 'manifest.json')) as f:
+                _asset_manifest = json.load(f)
+        except (OSError, ValueError):
+            # Not built yet: fall back to plain static URLs
+            _asset_manifest = {}
+    return _asset_manifest
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL for a static asset, content-hashed when the asset build has run"""
+    hashed = load_asset_manifest().get(filename)
+    if hashed:
+        return url_for('hashed_asset', filename=hashed)
+    return url_for('static', filename=filename)
+
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    dist_dir = app.config['ASSET_DIST_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    # Serve the best precompressed variant the client accepts
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(os.path.join(dist_dir, filename + suffix)):
+            encoding = candidate
+            break
+
+    suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+    response = send_from_directory(dist_dir, filename + suffix, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.endswith(ASSET_COMPRESSIBLE_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static assets."""
+    for filename, hashed in build_assets().items():
+        print(f"✅ {filename} -> {hashed}")
+
+
+# Request profiling: cProfile writes .pstats, the stack sampler writes collapsed
+# stacks ("outer;inner count" lines) for flamegraph.pl / speedscope
+PROFILE_MODES = {'cprofile': 'pstats', 'sampling': 'collapsed'}
+PROFILE_SKIP_ENDPOINTS = {'static', 'hashed_asset', 'admin_profiles', 'download_profile'}
+PROFILE_FILENAME = re.compile(r'^(\d{8}-\d{6}-\d{6})_([A-Z]+)_(.*)_(\d+)ms\.(pstats|collapsed)$')
+
+
+class RequestProfiler:
+    """Profiles the calling thread from start() until finish()"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.thread_id = threading.get_ident()
+        self.started_at = datetime.now()
+        self.profile = None
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.clock = time.perf_counter()
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile at a time; sample instead
+                self.mode = 'sampling'
+        if self.mode == 'sampling':
+            self._sampler = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample(self):
+        interval = app.config['PROFILE_SAMPLE_INTERVAL']
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def finish(self, method, path):
+        """Stop profiling and write the profile file; returns its name"""
+        elapsed_ms = int((time.perf_counter() - self.clock) * 1000)
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            self._stop.set()
+            self._sampler.join()
+
+        slug = re.sub(r'[^A-Za-z0-9.-]+', '-', path.strip('/').replace('/', '.'))[:80] or 'index'
+        name = (f"{self.started_at.strftime('%Y%m%d-%H%M%S-%f')}_{method}_{slug}_{elapsed_ms}ms"
+                f".{PROFILE_MODES[self.mode]}")
+        directory = app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        if self.mode == 'cprofile':
+            self.profile.dump_stats(os.path.join(directory, name))
+        else:
+            with open(os.path.join(directory, name), 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+        rotate_profiles()
+        return name
+
+
+def rotate_profiles():
+    """Keep only the newest PROFILE_MAX_FILES profiles"""
+    directory = app.config['PROFILE_DIR']
+    names = sorted(name for name in os.listdir(directory) if PROFILE_FILENAME.match(name))
+    for name in names[:-app.config['PROFILE_MAX_FILES']]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def requested_profile_mode():
+    """Profiling mode for this request, or None"""
+    if request.endpoint in PROFILE_SKIP_ENDPOINTS:
+        return None
+    flag = request.headers.get('X-Profile') or request.args.get('_profile')
+    if flag and current_user.is_authenticated and current_user.is_admin:
+        return flag if flag in PROFILE_MODES else app.config['PROFILE_DEFAULT_MODE']
+    if random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        return app.config['PROFILE_DEFAULT_MODE']
+    return None
+
+
+@app.before_request
+def start_request_profile():
+    mode = requested_profile_mode()
+    if mode:
+        g.request_profiler = RequestProfiler(mode).start()
+
+
+@app.after_request
+def finish_request_profile(response):
+    profiler = g.pop('request_profiler', None)
+    if profiler:
+        # Stop once the body has been sent, so streamed exports are covered too
+        method, path = request.method, request.path
+        response.call_on_close(lambda: profiler.finish(method, path))
+    return response
+
+
+def list_profiles():
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = PROFILE_FILENAME.match(name)
+        if match:
+            stamp, method, path, elapsed_ms, kind = match.groups()
+            profiles.append({
+                'name': name,
+                'taken_at': datetime.strptime(stamp, '%Y%m%d-%H%M%S-%f'),
+                'method': method,
+                'path': '/' + path.replace('.', '/') if path != 'index' else '/',
+                'elapsed_ms': int(elapsed_ms),
+                'kind': kind,
+                'size': os.path.getsize(os.path.join(directory, name))
+            })
+    return profiles
+
+
+def profile_summary(name, limit=30):
+    """Top functions of a .pstats profile, or hottest stacks of a collapsed one, as text"""
+    path = os.path.join(app.config['PROFILE_DIR'], name)
+    if name.endswith('.pstats'):
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).strip_dirs().sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+    self_samples = Counter()
+    total = 0
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            self_samples[stack.rsplit(';', 1)[-1]] += int(count)
+            total += int(count)
+    lines = [f'{total} samples, {app.config["PROFILE_SAMPLE_INTERVAL"] * 1000:g} ms apart', '',
+             f'{"self %":>7}  {"samples":>7}  function']
+    for function, count in self_samples.most_common(limit):
+        lines.append(f'{count / total * 100:>6.1f}%  {count:>7}  {function}')
+    return '\n'.join(lines)
+
+
+@app.route('/admin/profiles')
+@login_required
+@admin_required
+def admin_profiles():
+    profiles = list_profiles()
+    selected = request.args.get('show')
+    summary = None
+    if selected and any(profile['name'] == selected for profile in profiles):
+        summary = profile_summary(selected)
+    return render_template('admin/profiles.html',
+                           profiles=profiles,
+                           selected=selected,
+                           summary=summary,
+                           sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                           max_files=app.config['PROFILE_MAX_FILES'])
+
+
+@app.route('/admin/profiles/<name>')
+@login_required
+@admin_required
+def download_profile(name):
+    if not PROFILE_FILENAME.match(name):
+        return "Unknown profile", 404
+    return send_from_directory(app.config['PROFILE_DIR'], name, as_attachment=True)
+
+
+# Response compression: negotiated br/gzip for text responses, buffered or streamed
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml', 'text/calendar'
+}
+
+_compression_stats = {}
+_compression_lock = threading.Lock()
+
+
+def response_compressor(encoding):
+    """(compress, finish) callables for an incremental br or gzip stream"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def record_compression(endpoint, encoding, bytes_in, bytes_out, cpu_seconds):
+    with _compression_lock:
+        stats = _compression_stats.setdefault(
+            (endpoint or 'unknown', encoding),
+            {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0}
+        )
+        stats['responses'] += 1
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += bytes_out
+        stats['cpu_seconds'] += cpu_seconds
+
+
+def compress_stream(chunks, source, encoding, endpoint):
+    """Compress a streamed body chunk by chunk, recording totals once it ends"""
+    compress, finish = response_compressor(encoding)
+    bytes_in = bytes_out = 0
+    cpu_seconds = 0.0
+    try:
+        for chunk in chunks:
+            started = time.thread_time()
+            compressed = compress(chunk)
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(chunk)
+            if compressed:
+                bytes_out += len(compressed)
+                yield compressed
+        started = time.thread_time()
+        compressed = finish()
+        cpu_seconds += time.thread_time() - started
+        bytes_out += len(compressed)
+        yield compressed
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+        record_compression(endpoint, encoding, bytes_in, bytes_out, cpu_seconds)
+
+
+@app.after_request
+def compress_response(response):
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    if response.is_streamed:
+        # Size is unknown up front, so streamed bodies are always compressed
+        source = response.response
+        response.response = compress_stream(response.iter_encoded(), source, encoding, request.endpoint)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        started = time.thread_time()
+        compress, finish = response_compressor(encoding)
+        compressed = compress(data) + finish()
+        record_compression(request.endpoint, encoding, len(data), len(compressed), time.thread_time() - started)
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compression_metrics():
+    with _compression_lock:
+        return [
+            {
+                'endpoint': endpoint,
+                'encoding': encoding,
+                'responses': stats['responses'],
+                'bytes_in': stats['bytes_in'],
+                'bytes_out': stats['bytes_out'],
+                'ratio': round(stats['bytes_out'] / stats['bytes_in'], 4) if stats['bytes_in'] else None,
+                'cpu_ms': round(stats['cpu_seconds'] * 1000, 2),
+                'cpu_ms_per_mb': round(stats['cpu_seconds'] * 1000 / (stats['bytes_in'] / 1048576), 2)
+                if stats['bytes_in'] else None
+            }
+            for (endpoint, encoding), stats in sorted(_compression_stats.items())
+        ]
+
+
+@app.route('/admin/metrics/compression')
+@login_required
+@admin_required
+def compression_metrics_view():
+    return jsonify(compression_metrics())
+
+
 # Routes
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
+def select_site(site):
+    """Use the site chosen on the login/register form, if it is a known one"""
+    if site in app.config['SITES']:
+        g.site = site
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
+        select_site(request.form.get('site'))
         employee_id = request.form.get('employee_id')
         first_name = request.form.get('first_name')
         last_name = request.form.get('last_name')
@@ -175,6 +1435,7 @@ def register():
             user.password = password
             db.session.add(user)
             db.session.commit()
+            site_coworker_index().refresh(user)
 
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('login'))
@@ -183,7 +1444,7 @@ def register():
             flash(f'Registration failed: {str(e)}', 'danger')
             return redirect(url_for('register'))
 
-    return render_template('register.html')
+    return render_template('register.html', sites=app.config['SITES'])
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -192,6 +1453,7 @@ def login():
         return redirect(url_for('dashboard'))
 
     if request.method == 'POST':
+        select_site(request.form.get('site'))
         email = request.form.get('email')
         password = request.form.get('password')
         remember = True if request.form.get('remember') else False
@@ -209,7 +1471,7 @@ def login():
         else:
             flash('Invalid email or password!', 'danger')
 
-    return render_template('login.html')
+    return render_template('login.html', sites=app.config['SITES'])
 
 
 @app.route('/logout')
@@ -285,19 +1547,9 @@ def user_dashboard():
         .order_by(Leave.applied_date.desc()).limit(5).all()
 
     # Leave balances
-    annual_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Annual',
-        status='Approved'
-    ).count()
-    sick_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Sick',
-        status='Approved'
-    ).count()
-
-    annual_balance = app.config['ANNUAL_LEAVE_DAYS'] - annual_taken
-    sick_balance = app.config['SICK_LEAVE_DAYS'] - sick_taken
+    balances = leave_balances(current_user)
+    annual_balance = balances['Annual']
+    sick_balance = balances['Sick']
 
     return render_template('user/dashboard.html',
                            total_leaves=total_leaves,
@@ -379,7 +1631,11 @@ def apply_leave():
 
         elif coworker_id and coworker_id != '':
             # Apply leave for existing coworker
-            user_id = int(coworker_id)
+            coworker = db.session.get(User, int(coworker_id)) if coworker_id.isdigit() else None
+            if coworker is None or not coworker.is_active or coworker.is_admin:
+                flash('Select an active employee to apply for.', 'danger')
+                return redirect(url_for('apply_leave'))
+            user_id = coworker.id
             is_coworker_application = True
             ticket_number = request.form.get('ticket_number')
         else:
@@ -399,29 +1655,24 @@ def apply_leave():
             if day.weekday() < 5:  # Monday to Friday
                 total_days += 1
 
-        # Check leave balance for self applications only
-        if user_id == current_user.id:
-            if leave_type == 'Annual':
-                annual_taken = Leave.query.filter_by(
-                    user_id=current_user.id,
-                    leave_type='Annual',
-                    status='Approved'
-                ).count()
-                annual_balance = app.config['ANNUAL_LEAVE_DAYS'] - annual_taken
-                if total_days > annual_balance:
-                    flash(f'Insufficient Annual leave balance! You have {annual_balance} days left.', 'danger')
-                    return redirect(url_for('apply_leave'))
-
-            elif leave_type == 'Sick':
-                sick_taken = Leave.query.filter_by(
-                    user_id=current_user.id,
-                    leave_type='Sick',
-                    status='Approved'
-                ).count()
-                sick_balance = app.config['SICK_LEAVE_DAYS'] - sick_taken
-                if total_days > sick_balance:
-                    flash(f'Insufficient Sick leave balance! You have {sick_balance} days left.', 'danger')
-                    return redirect(url_for('apply_leave'))
+        # Hold the days against the balance; committed together with the leave below.
+        # New workers are created with a pro-rated balance, so theirs isn't enforced.
+        applicant = db.session.get(User, user_id)
+        enforce = leave_type in BALANCE_CHECKED_TYPES and not is_new_worker
+        try:
+            reserved = reserve_leave_days(applicant, leave_type, start.year, total_days, enforce)
+        except OperationalError as e:
+            if not is_database_locked(e):
+                raise
+            db.session.rollback()
+            flash('The system is busy right now. Please submit your application again.', 'warning')
+            return redirect(url_for('apply_leave'))
+        if not reserved:
+            db.session.rollback()
+            balance = leave_balances(applicant, start.year)[leave_type]
+            holder = 'You have' if user_id == current_user.id else f'{applicant.get_full_name()} has'
+            flash(f'Insufficient {leave_type} leave balance! {holder} {balance} days left.', 'danger')
+            return redirect(url_for('apply_leave'))
 
         # Create leave application
         leave = Leave(
@@ -442,7 +1693,11 @@ def apply_leave():
         #     leave.ticket_number = ticket_number
 
         db.session.add(leave)
+        queue_leave_notification(leave, applicant)
         db.session.commit()
+        wake_notification_dispatcher()
+        if is_new_worker:
+            site_coworker_index().refresh(new_user)
 
         # Show appropriate success message
         if is_new_worker:
@@ -456,47 +1711,18 @@ def apply_leave():
 
         return redirect(url_for('leave_status'))
 
-    # For GET request, get coworkers list for the dropdown
-    coworkers = User.query.filter(
-        User.is_admin == False,
-        User.is_active == True,
-        User.id != current_user.id
-    ).order_by(User.first_name, User.last_name).all()
-
     # Calculate leave balances for self
-    annual_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Annual',
-        status='Approved'
-    ).count()
-    sick_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Sick',
-        status='Approved'
-    ).count()
-
-    casual_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Casual',
-        status='Approved'
-    ).count()
-    emergency_taken = Leave.query.filter_by(
-        user_id=current_user.id,
-        leave_type='Emergency',
-        status='Approved'
-    ).count()
-
-    annual_balance = app.config['ANNUAL_LEAVE_DAYS'] - annual_taken
-    sick_balance = app.config['SICK_LEAVE_DAYS'] - sick_taken
-    casual_balance = app.config['CASUAL_LEAVE_DAYS'] - casual_taken
-    emergency_balance = app.config['EMERGENCY_LEAVE_DAYS'] - emergency_taken
+    balances = leave_balances(current_user)
+    annual_balance = balances['Annual']
+    sick_balance = balances['Sick']
+    casual_balance = balances['Casual']
+    emergency_balance = balances['Emergency']
 
     # Get recent leaves for the current user
     recent_leaves = Leave.query.filter_by(user_id=current_user.id) \
         .order_by(Leave.applied_date.desc()).limit(5).all()
 
     return render_template('user/apply_leave.html',
-                           coworkers=coworkers,
                            annual_balance=annual_balance,
                            sick_balance=sick_balance,
                            casual_balance=casual_balance,
@@ -504,6 +1730,77 @@ def apply_leave():
                            recent_leaves=recent_leaves)
 
 
+@app.route('/api/coworkers/search')
+@login_required
+def search_coworkers():
+    """Typeahead for the coworker and employee pickers (Select2 format)"""
+    try:
+        limit = min(int(request.args.get('limit', COWORKER_SEARCH_LIMIT)), 50)
+    except ValueError:
+        limit = COWORKER_SEARCH_LIMIT
+
+    results = site_coworker_index().search(request.args.get('q', ''), limit=limit, exclude_id=current_user.id)
+    return jsonify({'results': results})
+
+
+# Changes feed: rows of the tracked tables written after a cursor token
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 5000
+# Columns never sent over the feed
+CHANGES_EXCLUDED_COLUMNS = {'password_hash'}
+
+
+def _json_value(value):
+    # Dates, times and datetimes
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def changes_since(since, limit=CHANGES_PAGE_SIZE, tables=None):
+    """Up to `limit` changed rows with change_seq > since, oldest first.
+
+    Each table is read through its change_seq index and the pages are merged
+    by sequence, so one token covers every table. Returns (changes, has_more).
+    """
+    pages = []
+    for name in tables or CHANGE_TRACKED_TABLES:
+        table = db.metadata.tables[name]
+        columns = [column for column in table.columns if column.name not in CHANGES_EXCLUDED_COLUMNS]
+        rows = db.session.execute(
+            db.select(*columns).where(table.c.change_seq > since).order_by(table.c.change_seq).limit(limit + 1)
+        ).mappings().all()
+        pages.append([{
+            'table': name,
+            'seq': row['change_seq'],
+            'updated_at': _json_value(row['updated_at']),
+            'row': {key: _json_value(value) for key, value in row.items()}
+        } for row in rows])
+
+    changes = list(heapq.merge(*pages, key=lambda change: change['seq']))
+    return changes[:limit], len(changes) > limit
+
+
+@app.route('/api/changes')
+@login_required
+@admin_required
+def changes_feed():
+    """Incremental sync: pass the previous page's next_token as ?since= until has_more is false"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', CHANGES_PAGE_SIZE)), CHANGES_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+    tables = [name for name in request.args.get('tables', '').split(',') if name] or None
+    if tables and not set(tables) <= set(CHANGE_TRACKED_TABLES):
+        return jsonify({'error': f"tables must be among {', '.join(CHANGE_TRACKED_TABLES)}"}), 400
+
+    changes, has_more = changes_since(since, limit, tables)
+    return jsonify({
+        'changes': changes,
+        'next_token': str(changes[-1]['seq'] if changes else since),
+        'has_more': has_more
+    })
+
+
 @app.route('/user/leave_status')
 @login_required
 def leave_status():
@@ -518,13 +1815,16 @@ def leave_status():
 
     return render_template('user/leave_status.html',
                            leaves=leaves,
+                           my_calendar_url=calendar_feed_url('employee', current_user.id),
+                           department_calendar_url=(calendar_feed_url('department', current_user.department)
+                                                    if current_user.department else None),
                            total_leaves=total_leaves,
                            approved_leaves=approved_leaves,
                            pending_leaves=pending_leaves,
                            rejected_leaves=rejected_leaves)
 
 
-from flask import make_response, request, send_file
+from flask import make_response, request, send_file, stream_with_context
 import csv
 import io
 from datetime import datetime
@@ -533,11 +1833,17 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 from io import BytesIO
+import itertools
+import tempfile
+
+# Rows fetched per round trip when streaming export rows
+EXPORT_BATCH_SIZE = 2000
 
 
 @app.route('/admin/leaves/export', methods=['POST'])
 @login_required
 @admin_required
+@reads_reporting_snapshot
 def export_leaves():
     format_type = request.form.get('format', 'csv')
     status_filter = request.form.get('status', 'all')
@@ -562,114 +1868,191 @@ def export_leaves():
         query = query.filter(Leave.start_date >= datetime.strptime(date_from_filter, '%Y-%m-%d').date())
 
     if search_filter:
-        query = query.filter(
-            db.or_(
-                User.first_name.ilike(f'%{search_filter}%'),
-                User.last_name.ilike(f'%{search_filter}%'),
-                User.employee_id.ilike(f'%{search_filter}%')
-            )
-        )
+        query = apply_leave_search(query, search_filter)
 
-    leaves = query.order_by(Leave.applied_date.desc()).all()
+    query = query.order_by(Leave.applied_date.desc())
 
     if format_type == 'csv':
-        return export_leaves_csv(leaves)
+        return export_leaves_csv(query)
     elif format_type == 'pdf':
-        return export_leaves_pdf(leaves)
+        return export_leaves_pdf(query)
     else:
         return "Invalid format", 400
 
-def export_leaves_csv(leaves):
-    """Export leaves as CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    writer.writerow(['Employee ID', 'Employee Name', 'Department', 'Leave Type',
-                     'Start Date', 'End Date', 'Total Days', 'Reason',
-                     'Applied Date', 'Status', 'Approved/Rejected By', 'Admin Comment'])
-
-    # Write data
-    for leave in leaves:
-        writer.writerow([
-            leave.applicant.employee_id,
-            leave.applicant.get_full_name(),
-            leave.applicant.department,
-            leave.leave_type,
-            leave.start_date.strftime('%Y-%m-%d'),
-            leave.end_date.strftime('%Y-%m-%d'),
-            leave.total_days,
-            leave.reason,
-            leave.applied_date.strftime('%Y-%m-%d'),
-            leave.status,
-            leave.approver.get_full_name() if leave.approver else '',
-            leave.admin_comment or ''
-        ])
+def export_leaves_csv(query):
+    """Export leaves as CSV, streamed in batches"""
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+
+        # Write header
+        writer.writerow(['Employee ID', 'Employee Name', 'Department', 'Leave Type',
+                         'Start Date', 'End Date', 'Total Days', 'Reason',
+                         'Applied Date', 'Status', 'Approved/Rejected By', 'Admin Comment'])
+
+        # Write data
+        leaves = query.options(joinedload(Leave.applicant), joinedload(Leave.approver)) \
+            .yield_per(EXPORT_BATCH_SIZE)
+        for count, leave in enumerate(leaves, 1):
+            writer.writerow([
+                leave.applicant.employee_id,
+                leave.applicant.get_full_name(),
+                leave.applicant.department,
+                leave.leave_type,
+                leave.start_date.strftime('%Y-%m-%d'),
+                leave.end_date.strftime('%Y-%m-%d'),
+                leave.total_days,
+                leave.reason,
+                leave.applied_date.strftime('%Y-%m-%d'),
+                leave.status,
+                leave.approver.get_full_name() if leave.approver else '',
+                leave.admin_comment or ''
+            ])
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
 
     # Create response
-    response = make_response(output.getvalue())
+    response = app.response_class(stream_with_context(generate()), mimetype='text/csv')
     response.headers[
         'Content-Disposition'] = f'attachment; filename=leaves_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    response.headers['Content-type'] = 'text/csv'
     return response
 
 
-def export_leaves_pdf(leaves):
-    """Export leaves as PDF"""
-    try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet
-        from reportlab.lib import colors
-
-        # Create PDF in memory
-        pdf_buffer = BytesIO()
-
-        doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-
-        # Title
-        title = Paragraph(f"<b>Leave Requests Report</b>", styles['Title'])
-        elements.append(title)
-        elements.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-        elements.append(Spacer(1, 20))
+# Leave PDF export: fixed-height rows so every page holds a known number
+LEAVE_PDF_HEADER = ['Employee', 'Department', 'Leave Type', 'From', 'To', 'Days', 'Status']
+LEAVE_PDF_COL_WIDTHS = [2 * inch, 1.5 * inch, 1 * inch, 1 * inch, 1 * inch, 0.5 * inch, 1 * inch]
+LEAVE_PDF_MAX_CHARS = [30, 22, 14, 10, 10, 5, 12]
+LEAVE_PDF_ROW_HEIGHT = 16
+LEAVE_PDF_MARGIN = 0.6 * inch
+LEAVE_PDF_TITLE_HEIGHT = 80
 
-        # Create table data
-        table_data = [['Employee', 'Department', 'Leave Type', 'From', 'To', 'Days', 'Status']]
 
-        for leave in leaves:
-            table_data.append([
-                leave.applicant.get_full_name(),
-                leave.applicant.department or '',
-                leave.leave_type,
-                leave.start_date.strftime('%Y-%m-%d'),
-                leave.end_date.strftime('%Y-%m-%d'),
-                str(leave.total_days),
-                leave.status
-            ])
+def leave_pdf_rows(query):
+    """Yield PDF table rows for a Leave/User query without loading ORM objects"""
+    rows = query.with_entities(
+        User.first_name,
+        User.last_name,
+        User.department,
+        Leave.leave_type,
+        Leave.start_date,
+        Leave.end_date,
+        Leave.total_days,
+        Leave.status
+    ).yield_per(EXPORT_BATCH_SIZE)
+
+    for row in rows:
+        yield [
+            f"{row.first_name} {row.last_name}",
+            row.department or '',
+            row.leave_type,
+            row.start_date.strftime('%Y-%m-%d'),
+            row.end_date.strftime('%Y-%m-%d'),
+            str(row.total_days),
+            row.status
+        ]
 
-        # Create table
-        table = Table(table_data, colWidths=[2 * inch, 1.5 * inch, 1 * inch, 1 * inch, 1 * inch, 0.5 * inch, 1 * inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
 
-        elements.append(table)
+def build_leaves_pdf(rows, output, total_rows=None, max_rows=None):
+    """Draw leave rows onto PDF pages, one fixed-size table per page.
+
+    Rows are consumed one page at a time and each page is drawn straight
+    onto the canvas, so ReportLab never has to lay out (or split) one huge
+    table and memory stays flat however many rows are exported. When
+    total_rows exceeds max_rows, only max_rows are drawn and the first page
+    says so.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+
+    page_width, page_height = letter
+    usable_height = page_height - 2 * LEAVE_PDF_MARGIN
+    rows_per_page = int(usable_height // LEAVE_PDF_ROW_HEIGHT) - 1
+    rows_first_page = int((usable_height - LEAVE_PDF_TITLE_HEIGHT) // LEAVE_PDF_ROW_HEIGHT) - 1
+    table_x = (page_width - sum(LEAVE_PDF_COL_WIDTHS)) / 2
+
+    truncated = max_rows is not None and total_rows is not None and total_rows > max_rows
+    if max_rows is not None:
+        rows = itertools.islice(rows, max_rows)
+
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
+    ])
+
+    pdf = canvas.Canvas(output, pagesize=letter, pageCompression=1)
+    pdf.setTitle('Leave Requests Report')
+    generated_on = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    page_number = 0
+
+    while True:
+        chunk_size = rows_first_page if page_number == 0 else rows_per_page
+        chunk = [
+            [str(value)[:limit] for value, limit in zip(row, LEAVE_PDF_MAX_CHARS)]
+            for row in itertools.islice(rows, chunk_size)
+        ]
+        if not chunk and page_number > 0:
+            break
+        page_number += 1
+
+        top = page_height - LEAVE_PDF_MARGIN
+        if page_number == 1:
+            pdf.setFont('Helvetica-Bold', 16)
+            pdf.drawCentredString(page_width / 2, top - 16, 'Leave Requests Report')
+            pdf.setFont('Helvetica', 9)
+            pdf.drawString(table_x, top - 40, f"Generated on: {generated_on}")
+            if truncated:
+                pdf.setFillColor(colors.red)
+                pdf.drawString(table_x, top - 56,
+                               f"Showing the first {max_rows:,} of {total_rows:,} leave requests. "
+                               f"Narrow the filters or use CSV export for the full list.")
+                pdf.setFillColor(colors.black)
+            elif not chunk:
+                pdf.drawString(table_x, top - 56, 'No leave requests match the selected filters.')
+            top -= LEAVE_PDF_TITLE_HEIGHT
+
+        # Header repeated on every page
+        table = Table([LEAVE_PDF_HEADER] + chunk,
+                      colWidths=LEAVE_PDF_COL_WIDTHS,
+                      rowHeights=LEAVE_PDF_ROW_HEIGHT)
+        table.setStyle(table_style)
+        _, table_height = table.wrapOn(pdf, page_width, page_height)
+        table.drawOn(pdf, table_x, top - table_height)
+
+        pdf.setFont('Helvetica', 8)
+        pdf.drawRightString(page_width - LEAVE_PDF_MARGIN, LEAVE_PDF_MARGIN / 2, f"Page {page_number}")
+        pdf.showPage()
+
+        if len(chunk) < chunk_size:
+            break
+
+    pdf.save()
+    return page_number
+
+
+def export_leaves_pdf(query):
+    """Export leaves as PDF"""
+    total_rows = query.count()
+    max_rows = app.config['PDF_EXPORT_MAX_ROWS']
 
-        # Build PDF
-        doc.build(elements)
-        pdf_buffer.seek(0)
+    try:
+        # Build into an anonymous temp file so large exports don't sit in memory
+        pdf_file = tempfile.TemporaryFile(suffix='.pdf')
+        build_leaves_pdf(leave_pdf_rows(query), pdf_file, total_rows=total_rows, max_rows=max_rows)
+        pdf_file.seek(0)
 
         return send_file(
-            pdf_buffer,
+            pdf_file,
             mimetype='application/pdf',
             as_attachment=True,
             download_name=f'leaves_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
@@ -680,10 +2063,8 @@ def export_leaves_pdf(leaves):
         text_content = "Leave Requests Report\n"
         text_content += f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
 
-        for leave in leaves:
-            text_content += f"{leave.applicant.get_full_name()} | {leave.applicant.department} | {leave.leave_type} | "
-            text_content += f"{leave.start_date.strftime('%Y-%m-%d')} to {leave.end_date.strftime('%Y-%m-%d')} | "
-            text_content += f"{leave.total_days} days | {leave.status}\n"
+        for name, department, leave_type, start, end, days, status in leave_pdf_rows(query):
+            text_content += f"{name} | {department} | {leave_type} | {start} to {end} | {days} days | {status}\n"
 
         response = make_response(text_content)
         response.headers[
@@ -692,25 +2073,200 @@ def export_leaves_pdf(leaves):
         return response
 
 
-@app.route('/admin/leave/action/<int:leave_id>', methods=['POST'])
-@login_required
-@admin_required
-def leave_action(leave_id):
-    leave = Leave.query.get_or_404(leave_id)
+# Columnar history export (Parquet / Arrow IPC) for analysts loading into pandas
+COLUMNAR_BATCH_SIZE = 50000
+COLUMNAR_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+COLUMNAR_DATASETS = ['leaves', 'attendance']
+
+
+def _columnar_fields(dataset):
+    """(name, arrow type) per column; None marks a dictionary-encoded string"""
+    if dataset == 'leaves':
+        return [
+            ('id', pa.int64()), ('employee_id', pa.string()), ('employee_name', pa.string()),
+            ('department', None), ('leave_type', None), ('status', None),
+            ('start_date', pa.date32()), ('end_date', pa.date32()), ('total_days', pa.int32()),
+            ('reason', pa.string()), ('applied_date', pa.timestamp('us')),
+            ('approved_by', pa.string()), ('approved_date', pa.timestamp('us')), ('admin_comment', pa.string())
+        ]
+    return [
+        ('id', pa.int64()), ('employee_id', pa.string()), ('department', None),
+        ('date', pa.date32()), ('check_in', pa.time64('us')), ('check_out', pa.time64('us')),
+        ('status', None), ('worked_hours', pa.float64()), ('overtime_hours', pa.float64()),
+        ('remarks', pa.string())
+    ]
+
+
+def _columnar_query(dataset, conn):
+    """The dataset's full history as a statement, plus the distinct values of
+    each dictionary-encoded column"""
+    if dataset == 'leaves':
+        approver = db.aliased(User)
+        statement = db.select(
+            Leave.id, User.employee_id, User.first_name + ' ' + User.last_name, User.department,
+            Leave.leave_type, Leave.status, Leave.start_date, Leave.end_date, Leave.total_days,
+            Leave.reason, Leave.applied_date, approver.employee_id, Leave.approved_date, Leave.admin_comment
+        ).join(User, Leave.user_id == User.id).outerjoin(approver, Leave.approved_by == approver.id) \
+            .order_by(Leave.id)
+        source = 'leave l JOIN user u ON u.id = l.user_id'
+        distinct = {'department': 'u.department', 'leave_type': 'l.leave_type', 'status': 'l.status'}
+    else:
+        # Archived years are included through the history view, sorted by day
+        view = attendance_history_view(archived_attendance_years(), conn=conn)
+        statement = db.text(f"""
+            SELECT a.id, u.employee_id, u.department, a.date, a.check_in, a.check_out,
+                   a.status, a.worked_hours, a.overtime_hours, a.remarks
+            FROM {view} a JOIN user u ON u.id = a.user_id
+            ORDER BY a.date, a.id
+        """).columns(date=db.Date, check_in=db.Time, check_out=db.Time)
+        source = f'{view} l JOIN user u ON u.id = l.user_id'
+        distinct = {'department': 'u.department', 'status': 'l.status'}
+
+    dictionaries = {}
+    for name, expression in distinct.items():
+        values = conn.execute(db.text(
+            f'SELECT DISTINCT {expression} FROM {source} WHERE {expression} IS NOT NULL ORDER BY 1'
+        )).scalars().all()
+        dictionaries[name] = pa.array(values, type=pa.string())
+    return statement, dictionaries
+
+
+def columnar_schema(dataset):
+    return pa.schema([
+        pa.field(name, pa.dictionary(pa.int32(), pa.string()) if arrow_type is None else arrow_type)
+        for name, arrow_type in _columnar_fields(dataset)
+    ])
+
+
+def columnar_batches(dataset, conn, batch_size=COLUMNAR_BATCH_SIZE):
+    """Stream a dataset as Arrow record batches of up to batch_size rows.
+
+    Dictionary columns share one dictionary across batches, so every row
+    group (and the Arrow IPC file) encodes them the same way.
+    """
+    fields = _columnar_fields(dataset)
+    schema = columnar_schema(dataset)
+    statement, dictionaries = _columnar_query(dataset, conn)
+
+    result = conn.execution_options(yield_per=batch_size).execute(statement)
+    for rows in result.partitions(batch_size):
+        arrays = []
+        for (name, arrow_type), values in zip(fields, zip(*rows)):
+            if arrow_type is None:
+                dictionary = dictionaries[name]
+                indices = pc.index_in(pa.array(values, type=pa.string()), value_set=dictionary)
+                arrays.append(pa.DictionaryArray.from_arrays(indices, dictionary))
+            else:
+                arrays.append(pa.array(values, type=arrow_type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar(dataset, file_format, sink, conn):
+    """Write a dataset's full history to sink as Parquet (one row group per
+    batch) or an Arrow IPC file; returns the number of rows"""
+    schema = columnar_schema(dataset)
+    rows = 0
+    if file_format == 'parquet':
+        with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+            for batch in columnar_batches(dataset, conn):
+                writer.write_table(pa.Table.from_batches([batch]))
+                rows += batch.num_rows
+    else:
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in columnar_batches(dataset, conn):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def columnar_connection():
+    # A select routes to the reporting snapshot when the route reads from it
+    return db.session.connection(bind_arguments={'clause': db.select(Leave.id)})
+
+
+@app.route('/admin/export/history/<dataset>.<file_format>')
+@login_required
+@admin_required
+@reads_reporting_snapshot
+def export_history_columnar(dataset, file_format):
+    if dataset not in COLUMNAR_DATASETS or file_format not in COLUMNAR_FORMATS:
+        return jsonify({'error': 'Unknown dataset or format'}), 404
+    if pa is None:
+        return jsonify({'error': 'Columnar export needs pyarrow installed'}), 501
+
+    # Build into an anonymous temp file; Parquet writes its footer last
+    output = tempfile.TemporaryFile(suffix=f'.{file_format}')
+    write_columnar(dataset, file_format, output, columnar_connection())
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype=COLUMNAR_FORMATS[file_format],
+        as_attachment=True,
+        download_name=f'{dataset}_history_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{file_format}'
+    )
+
+
+@app.cli.command('export-history')
+@click.option('--dataset', type=click.Choice(COLUMNAR_DATASETS + ['all']), default='all', show_default=True)
+@click.option('--format', 'file_format', type=click.Choice(list(COLUMNAR_FORMATS)), default='parquet',
+              show_default=True)
+@click.option('--output', 'output_dir', default='.', show_default=True, help='Directory to write into.')
+def export_history_command(dataset, file_format, output_dir):
+    """Export the full leave/attendance history as Parquet or Arrow IPC."""
+    if pa is None:
+        raise click.ClickException('Columnar export needs pyarrow installed')
+    os.makedirs(output_dir, exist_ok=True)
+    for name in COLUMNAR_DATASETS if dataset == 'all' else [dataset]:
+        path = os.path.join(output_dir, f'{name}_history.{file_format}')
+        started = time.perf_counter()
+        with open(path, 'wb') as output:
+            rows = write_columnar(name, file_format, output, columnar_connection())
+        print(f"✅ {name}: {rows:,} rows -> {path} ({os.path.getsize(path) / 1024:,.0f} KB) "
+              f"in {time.perf_counter() - started:.2f}s")
+
+
+@app.route('/admin/leave/action/<int:leave_id>', methods=['POST'])
+@login_required
+@admin_required
+def leave_action(leave_id):
+    leave = Leave.query.get_or_404(leave_id)
     action = request.form.get('action')
     comment = request.form.get('comment')
+    previous_status = leave.status
 
-    if action == 'approve':
-        leave.status = 'Approved'
-        leave.approved_by = current_user.id
-        leave.approved_date = datetime.utcnow()
-    elif action == 'reject':
-        leave.status = 'Rejected'
-        leave.approved_by = current_user.id
-        leave.approved_date = datetime.utcnow()
-
-    leave.admin_comment = comment
-    db.session.commit()
+    # Any flush below checks the leave's row_version, so a concurrent
+    # approve/reject of the same leave is caught before its days move twice
+    try:
+        begin_immediate()
+        if action == 'approve':
+            leave.status = 'Approved'
+            leave.approved_by = current_user.id
+            leave.approved_date = datetime.utcnow()
+        elif action == 'reject':
+            leave.status = 'Rejected'
+            leave.approved_by = current_user.id
+            leave.approved_date = datetime.utcnow()
+
+        leave.admin_comment = comment
+        if action in ('approve', 'reject'):
+            queue_leave_notification(leave, leave.applicant)
+        transfer_leave_days(leave, previous_status, leave.status)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        flash('This leave was updated by someone else in the meantime. Please review it again.', 'warning')
+        return redirect(url_for('admin_leaves'))
+    except OperationalError as e:
+        if not is_database_locked(e):
+            raise
+        db.session.rollback()
+        flash('The system is busy right now. Please try again.', 'warning')
+        return redirect(url_for('admin_leaves'))
+    wake_notification_dispatcher()
 
     flash(f'Leave {action}d successfully!', 'success')
     return redirect(url_for('admin_leaves'))
@@ -748,18 +2304,9 @@ def admin_leaves():
             pass  # Ignore invalid date format
 
     if search_filter and search_filter != '':
-        search = f'%{search_filter}%'
-        query = query.filter(
-            db.or_(
-                User.first_name.ilike(search),
-                User.last_name.ilike(search),
-                User.employee_id.ilike(search),
-                User.designation.ilike(search),
-                User.phone.ilike(search)
-            )
-        )
+        query = apply_leave_search(query, search_filter)
 
-    # Order by most recent first
+    # Order by best match (when searching), then most recent first
     leaves = query.order_by(Leave.applied_date.desc()).all()
 
     return render_template('admin/leaves.html',
@@ -774,8 +2321,33 @@ def admin_leaves():
 @login_required
 @admin_required
 def admin_employees():
-    employees = User.query.filter_by(is_admin=False).all()
-    return render_template('admin/employees.html', employees=employees)
+    search_filter = request.args.get('search')
+
+    query = User.query.filter_by(is_admin=False)
+
+    if search_filter and fts_query(search_filter):
+        if ensure_search_index():
+            results = employee_search_subquery(search_filter)
+            query = query.join(results, results.c.id == User.id).order_by(results.c.rank)
+        else:
+            search = f'%{search_filter}%'
+            query = query.filter(
+                db.or_(
+                    User.first_name.ilike(search),
+                    User.last_name.ilike(search),
+                    User.employee_id.ilike(search),
+                    User.designation.ilike(search),
+                    User.phone.ilike(search)
+                )
+            )
+
+    employees = query.all()
+    # One grouped count instead of loading every employee's leaves
+    leave_counts = dict(
+        db.session.query(Leave.user_id, db.func.count(Leave.id)).group_by(Leave.user_id).all()
+    )
+    return render_template('admin/employees.html', employees=employees, search_filter=search_filter,
+                           leave_counts=leave_counts)
 
 
 @app.route('/api/employee/<int:id>/deactivate', methods=['POST'])
@@ -788,6 +2360,7 @@ def deactivate_employee(id):
 
     employee.is_active = False
     db.session.commit()
+    site_coworker_index().refresh(employee)
     return jsonify({'message': 'Employee deactivated successfully'})
 @app.route('/api/employee/<int:id>/activate', methods=['POST'])
 @login_required
@@ -796,6 +2369,7 @@ def activate_employee(id):
     employee = User.query.get_or_404(id)
     employee.is_active = True
     db.session.commit()
+    site_coworker_index().refresh(employee)
     return jsonify({'message': 'Employee activated successfully'})
 
 
@@ -818,8 +2392,248 @@ def update_employee(id):
     employee.is_active = is_active
 
     db.session.commit()
+    site_coworker_index().refresh(employee)
     return jsonify({'message': 'Employee updated successfully'})
 
+# Bulk onboarding from a CSV or Excel sheet: one header row, then one employee per row
+from openpyxl import load_workbook
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import secrets
+
+ONBOARDING_COLUMNS = ['employee_id', 'first_name', 'last_name', 'email', 'phone',
+                      'department', 'designation', 'shift', 'date_of_joining']
+ONBOARDING_REQUIRED_COLUMNS = ['employee_id', 'first_name', 'last_name']
+# No 0/O or 1/l/I, so passwords can be read out over the phone
+TEMP_PASSWORD_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnpqrstuvwxyz23456789'
+TEMP_PASSWORD_LENGTH = 12
+
+
+def read_onboarding_rows(stream, filename):
+    """Data rows of an onboarding sheet as dicts keyed by lower_case header"""
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        rows = load_workbook(stream, read_only=True, data_only=True).active.iter_rows(values_only=True)
+    else:
+        rows = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = [str(name or '').strip().lower().replace(' ', '_') for name in next(rows, [])]
+    missing = [column for column in ONBOARDING_REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"missing column(s) {', '.join(missing)}")
+    return [dict(zip(header, values)) for values in rows if any(value not in (None, '') for value in values)]
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    # Excel stores numeric IDs and phone numbers as floats
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _joining_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _cell_text(value)
+    return datetime.strptime(text, '%Y-%m-%d').date() if text else date.today()
+
+
+def validate_onboarding_rows(rows):
+    """New-user dicts, plus (sheet row, problem) pairs for rows that can't be imported.
+
+    Employee IDs and emails are checked against sets loaded once, which also
+    catch duplicates within the sheet.
+    """
+    taken_ids = {employee_id.lower() for employee_id, in db.session.query(User.employee_id)}
+    taken_emails = {email.lower() for email, in db.session.query(User.email)}
+    users = []
+    errors = []
+    for line, row in enumerate(rows, start=2):
+        values = {column: _cell_text(row.get(column)) for column in ONBOARDING_COLUMNS}
+        missing = [column for column in ONBOARDING_REQUIRED_COLUMNS if not values[column]]
+        if missing:
+            errors.append((line, f"missing {', '.join(missing)}"))
+            continue
+        employee_id = values['employee_id']
+        email = values['email'] or f'{employee_id.lower()}@temp.textile.com'
+        try:
+            date_of_joining = _joining_date(row.get('date_of_joining'))
+        except ValueError:
+            errors.append((line, f"date_of_joining {values['date_of_joining']!r} is not YYYY-MM-DD"))
+            continue
+        if employee_id.lower() in taken_ids:
+            errors.append((line, f'employee ID {employee_id} already exists'))
+            continue
+        if '@' not in email:
+            errors.append((line, f'{email!r} is not an email address'))
+            continue
+        if email.lower() in taken_emails:
+            errors.append((line, f'email {email} is already registered'))
+            continue
+        taken_ids.add(employee_id.lower())
+        taken_emails.add(email.lower())
+        users.append({
+            'employee_id': employee_id,
+            'first_name': values['first_name'],
+            'last_name': values['last_name'],
+            'email': email,
+            'phone': values['phone'] or None,
+            'department': values['department'] or None,
+            'designation': values['designation'] or None,
+            'shift': values['shift'] or None,
+            'date_of_joining': date_of_joining
+        })
+    return users, errors
+
+
+def temporary_password():
+    return ''.join(secrets.choice(TEMP_PASSWORD_ALPHABET) for _ in range(TEMP_PASSWORD_LENGTH))
+
+
+# Batches smaller than this are hashed in-process; spawning a pool costs more
+ONBOARDING_POOL_MIN_ROWS = 50
+ONBOARDING_PROGRESS_EVERY = 100
+
+
+def hash_temporary_passwords(passwords, progress=None):
+    """Password hashes in order; large batches use a process pool that lives for this call only.
+
+    progress(done, total) is called every ONBOARDING_PROGRESS_EVERY hashes.
+    Pool workers are spawned, not forked, so they inherit no threads,
+    locks or database connections.
+    """
+    workers = min(app.config['ONBOARDING_HASH_WORKERS'], len(passwords))
+    executor = None
+    if workers <= 1 or len(passwords) < ONBOARDING_POOL_MIN_ROWS:
+        hashes = map(generate_password_hash, passwords)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        hashes = executor.map(generate_password_hash, passwords,
+                              chunksize=max(1, min(ONBOARDING_PROGRESS_EVERY, len(passwords) // (workers * 4))))
+    try:
+        results = []
+        for password_hash in hashes:
+            results.append(password_hash)
+            if progress and (len(results) % ONBOARDING_PROGRESS_EVERY == 0 or len(results) == len(passwords)):
+                progress(len(results), len(passwords))
+        return results
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def onboard_employees(users, progress=None):
+    """Insert validated users with temporary passwords; returns the passwords in order.
+
+    Rows go in with executemany in chunks, all in one transaction, so a
+    failed import leaves nothing behind. progress is passed on to
+    hash_temporary_passwords().
+    """
+    passwords = [temporary_password() for _ in users]
+    hashes = hash_temporary_passwords(passwords, progress)
+    now = datetime.utcnow()
+    rows = [
+        {**user, 'password_hash': password_hash, 'is_admin': False, 'is_active': True,
+         'created_at': now, 'row_version': 1}
+        for user, password_hash in zip(users, hashes)
+    ]
+    chunk_size = app.config['ONBOARDING_CHUNK_SIZE']
+    try:
+        for start in range(0, len(rows), chunk_size):
+            db.session.execute(db.insert(User), rows[start:start + chunk_size])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    site_coworker_index().rebuild()
+    return passwords
+
+
+def onboarding_credentials_csv(users, passwords, output):
+    writer = csv.writer(output)
+    writer.writerow(['Employee ID', 'First Name', 'Last Name', 'Email', 'Temporary Password'])
+    for user, password in zip(users, passwords):
+        writer.writerow([user['employee_id'], user['first_name'], user['last_name'], user['email'], password])
+
+
+@app.route('/admin/employees/import', methods=['POST'])
+@login_required
+@admin_required
+def import_employees():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV or Excel file to import.', 'danger')
+        return redirect(url_for('admin_employees'))
+
+    try:
+        rows = read_onboarding_rows(upload.stream, upload.filename)
+    except Exception as e:
+        flash(f'Could not read {upload.filename}: {e}', 'danger')
+        return redirect(url_for('admin_employees'))
+
+    max_rows = app.config['ONBOARDING_WEB_MAX_ROWS']
+    if len(rows) > max_rows:
+        # Hashing runs inside this request; bigger sheets would outlast worker timeouts
+        flash(f'{upload.filename} has {len(rows)} rows; the browser import takes up to {max_rows}. '
+              f'Import larger sheets on the server with: flask import-employees SHEET --passwords OUT.csv',
+              'warning')
+        return redirect(url_for('admin_employees'))
+
+    users, errors = validate_onboarding_rows(rows)
+    if errors:
+        shown = '; '.join(f'row {line}: {problem}' for line, problem in errors[:10])
+        more = f' (and {len(errors) - 10} more)' if len(errors) > 10 else ''
+        flash(f'Nothing imported, {len(errors)} row(s) need fixing: {shown}{more}', 'danger')
+        return redirect(url_for('admin_employees'))
+    if not users:
+        flash(f'{upload.filename} has no employees in it.', 'warning')
+        return redirect(url_for('admin_employees'))
+
+    started = time.perf_counter()
+    passwords = onboard_employees(users)
+    app.logger.info('Onboarded %d employees from %s in %.1fs', len(users), upload.filename,
+                    time.perf_counter() - started)
+
+    # The temporary passwords are only ever shown in this download
+    output = io.StringIO()
+    onboarding_credentials_csv(users, passwords, output)
+    response = make_response(output.getvalue())
+    response.headers['Content-Type'] = 'text/csv'
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=onboarding_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
+    )
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.cli.command('import-employees')
+@click.argument('sheet', type=click.Path(exists=True, dir_okay=False))
+@click.option('--passwords', 'passwords_path', required=True, type=click.Path(dir_okay=False),
+              help='CSV to write the temporary passwords to.')
+def import_employees_command(sheet, passwords_path):
+    """Onboard employees from a CSV or Excel sheet."""
+    with open(sheet, 'rb') as stream:
+        rows = read_onboarding_rows(stream, sheet)
+    users, errors = validate_onboarding_rows(rows)
+    for line, problem in errors:
+        print(f"❌ Row {line}: {problem}")
+    if errors:
+        raise SystemExit(f"Nothing imported: {len(errors)} row(s) need fixing")
+
+    started = time.perf_counter()
+
+    def report(done, total):
+        print(f"  Hashed {done}/{total} temporary passwords ({time.perf_counter() - started:.0f}s)")
+
+    passwords = onboard_employees(users, progress=report)
+    with open(passwords_path, 'w', newline='') as output:
+        onboarding_credentials_csv(users, passwords, output)
+    print(f"✅ Onboarded {len(users)} employees in {time.perf_counter() - started:.1f}s; "
+          f"temporary passwords in {passwords_path}")
+
+
 @app.route('/admin/attendance')
 @login_required
 @admin_required
@@ -834,13 +2648,10 @@ def admin_attendance():
     # Get attendance records for the date with employee details
     attendance_records = Attendance.query.options(joinedload(Attendance.employee)).filter_by(date=filter_date).all()
 
-    # Get all employees for the dropdown
-    employees = User.query.filter_by(is_admin=False, is_active=True).all()
-
+    # Employees are picked through the coworker typeahead
     return render_template('admin/attendance.html',
                            attendance_records=attendance_records,
-                           date_filter=date_filter,
-                           employees=employees)
+                           date_filter=date_filter)
 
 
 from flask import make_response, request, jsonify, send_file
@@ -852,14 +2663,11 @@ import pandas as pd
 from openpyxl import Workbook
 from io import BytesIO
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 
-@app.route('/admin/reports', methods=['GET', 'POST'])
-@login_required
-@admin_required
-def admin_reports():
-    from datetime import date
-
+def collect_report_data():
+    """Aggregates shown on the reports page and in its exports"""
     # Monthly attendance summary
     current_month = date.today().month
     current_year = date.today().year
@@ -891,20 +2699,19 @@ def admin_reports():
         User.is_active == True
     ).group_by(User.department).all()
 
-    # Monthly attendance trend (last 6 months)
+    # Monthly attendance trend (last 6 months), counted from the attendance bitmaps
     monthly_trend = []
+    present_by_month = {}
+    total_employees = User.query.filter_by(is_admin=False, is_active=True).count()
     for i in range(5, -1, -1):
         month_date = date.today() - timedelta(days=30 * i)
         month = month_date.month
         year = month_date.year
 
-        present_count = Attendance.query.filter(
-            db.extract('year', Attendance.date) == year,
-            db.extract('month', Attendance.date) == month,
-            Attendance.status == 'Present'
-        ).count()
+        if year not in present_by_month:
+            present_by_month[year] = presence_summary(year)['monthly']['Present']
+        present_count = present_by_month[year][month - 1]
 
-        total_employees = User.query.filter_by(is_admin=False, is_active=True).count()
         attendance_rate = (present_count / (total_employees * 22 * 0.01)) if total_employees > 0 else 0
 
         monthly_trend.append({
@@ -925,38 +2732,113 @@ def admin_reports():
     # Calculate attendance rate
     attendance_rate = (present_days / (total_employees * 22 * 0.01)) if total_employees > 0 else 0
 
+    return {
+        'attendance_summary': attendance_summary,
+        'leave_summary': leave_summary,
+        'dept_summary': dept_summary,
+        'monthly_trend': monthly_trend,
+        'total_employees': total_employees,
+        'present_days': present_days,
+        'approved_leaves': approved_leaves,
+        'attendance_rate': attendance_rate
+    }
+
+
+@app.route('/admin/reports', methods=['GET', 'POST'])
+@login_required
+@admin_required
+@reads_reporting_snapshot
+def admin_reports():
+    report_data = collect_report_data()
+
     # Handle POST request for export
     if request.method == 'POST':
         format_type = request.form.get('format')
 
         if format_type == 'csv':
-            return export_csv(attendance_summary, leave_summary, dept_summary, monthly_trend,
-                              total_employees, present_days, approved_leaves, attendance_rate)
+            return export_csv(**report_data)
         elif format_type == 'excel':
-            return export_excel(attendance_summary, leave_summary, dept_summary, monthly_trend,
-                                total_employees, present_days, approved_leaves, attendance_rate)
+            return export_excel(**report_data)
         elif format_type == 'json':
-            return export_json(attendance_summary, leave_summary, dept_summary, monthly_trend,
-                               total_employees, present_days, approved_leaves, attendance_rate)
+            return export_json(**report_data)
         elif format_type == 'pdf':
-            return export_pdf(attendance_summary, leave_summary, dept_summary, monthly_trend,
-                              total_employees, present_days, approved_leaves, attendance_rate)
+            return export_pdf(**report_data)
         else:
             return jsonify({'error': 'Invalid format specified'}), 400
 
     # For GET requests, render the template
     return render_template('admin/reports.html',
-                           attendance_summary=attendance_summary,
-                           leave_summary=leave_summary,
-                           dept_summary=dept_summary,
-                           monthly_trend=monthly_trend,
-                           current_month=current_month,
-                           current_year=current_year,
+                           attendance_summary=report_data['attendance_summary'],
+                           leave_summary=report_data['leave_summary'],
+                           dept_summary=report_data['dept_summary'],
+                           monthly_trend=report_data['monthly_trend'],
+                           current_month=date.today().month,
+                           current_year=date.today().year,
                            today=date.today(),
-                           total_employees=total_employees,
-                           present_days=present_days,
-                           approved_leaves=approved_leaves,
-                           attendance_rate=min(attendance_rate, 100))
+                           total_employees=report_data['total_employees'],
+                           present_days=report_data['present_days'],
+                           approved_leaves=report_data['approved_leaves'],
+                           attendance_rate=min(report_data['attendance_rate'], 100),
+                           charts=report_chart_fingerprints(report_data))
+
+
+def collect_site_report_data(site):
+    """collect_report_data() for one site, in its own app context"""
+    with app.app_context():
+        g.site = site
+        use_reporting_snapshot()
+        return collect_report_data()
+
+
+def merge_report_data(site_reports):
+    """Combine per-site report aggregates into group totals"""
+    attendance = {}
+    leaves = {}
+    departments = {}
+    trend = OrderedDict()
+    for report in site_reports.values():
+        for status, count in report['attendance_summary']:
+            attendance[status] = attendance.get(status, 0) + count
+        for leave_type, count, total_days in report['leave_summary']:
+            applications, days = leaves.get(leave_type, (0, 0))
+            leaves[leave_type] = (applications + count, days + (total_days or 0))
+        for department, count in report['dept_summary']:
+            departments[department] = departments.get(department, 0) + count
+        for month_data in report['monthly_trend']:
+            trend[month_data['month']] = trend.get(month_data['month'], 0) + month_data['present']
+
+    total_employees = sum(report['total_employees'] for report in site_reports.values())
+    present_days = sum(report['present_days'] for report in site_reports.values())
+
+    def rate(present):
+        return min(present / (total_employees * 22 * 0.01), 100) if total_employees > 0 else 0
+
+    return {
+        'attendance_summary': sorted(attendance.items()),
+        'leave_summary': [(leave_type, count, days) for leave_type, (count, days) in sorted(leaves.items())],
+        'dept_summary': sorted(departments.items(), key=lambda item: item[0] or ''),
+        'monthly_trend': [{'month': month, 'present': present, 'rate': rate(present)}
+                          for month, present in trend.items()],
+        'total_employees': total_employees,
+        'present_days': present_days,
+        'approved_leaves': sum(report['approved_leaves'] for report in site_reports.values()),
+        'attendance_rate': rate(present_days)
+    }
+
+
+@app.route('/admin/reports/group')
+@login_required
+@admin_required
+def admin_group_reports():
+    # Each site is a separate database, so query them side by side
+    sites = list(app.config['SITES'])
+    with ThreadPoolExecutor(max_workers=len(sites)) as executor:
+        site_reports = dict(zip(sites, executor.map(collect_site_report_data, sites)))
+
+    return render_template('admin/group_reports.html',
+                           site_reports=site_reports,
+                           group=merge_report_data(site_reports),
+                           today=date.today())
 
 
 def export_csv(attendance_summary, leave_summary, dept_summary, monthly_trend,
@@ -1085,6 +2967,141 @@ def export_excel(attendance_summary, leave_summary, dept_summary, monthly_trend,
     )
 
 
+def write_leave_detail_rows(ws, date_from=None, date_to=None):
+    """Append one row per leave to a write-only sheet, streaming from the database"""
+    ws.append(['Employee ID', 'Employee Name', 'Department', 'Leave Type', 'Start Date', 'End Date',
+               'Total Days', 'Reason', 'Applied Date', 'Status', 'Approved Date', 'Admin Comment'])
+
+    query = db.session.query(
+        User.employee_id,
+        User.first_name,
+        User.last_name,
+        User.department,
+        Leave.leave_type,
+        Leave.start_date,
+        Leave.end_date,
+        Leave.total_days,
+        Leave.reason,
+        Leave.applied_date,
+        Leave.status,
+        Leave.approved_date,
+        Leave.admin_comment
+    ).join(User, Leave.user_id == User.id)
+
+    if date_from:
+        query = query.filter(Leave.end_date >= date_from)
+    if date_to:
+        query = query.filter(Leave.start_date <= date_to)
+
+    count = 0
+    for row in query.order_by(Leave.id).yield_per(EXPORT_BATCH_SIZE):
+        ws.append([
+            row.employee_id,
+            f"{row.first_name} {row.last_name}",
+            row.department,
+            row.leave_type,
+            row.start_date,
+            row.end_date,
+            row.total_days,
+            row.reason,
+            row.applied_date,
+            row.status,
+            row.approved_date,
+            row.admin_comment
+        ])
+        count += 1
+    return count
+
+
+def write_attendance_detail_rows(ws, date_from=None, date_to=None):
+    """Append one row per attendance record to a write-only sheet, streaming from the database.
+
+    Archived years in the range are read through the attendance history view.
+    """
+    ws.append(['Employee ID', 'Employee Name', 'Department', 'Date', 'Check In', 'Check Out',
+               'Status', 'Overtime Hours', 'Remarks'])
+
+    years = [year for year in archived_attendance_years()
+             if (date_from is None or year >= date_from.year) and (date_to is None or year <= date_to.year)]
+    conn = columnar_connection()
+    view = attendance_history_view(years, conn=conn)
+    statement = db.text(f"""
+        SELECT u.employee_id, u.first_name, u.last_name, u.department, a.date, a.check_in, a.check_out,
+               a.status, a.overtime_hours, a.remarks
+        FROM {view} a JOIN user u ON u.id = a.user_id
+        WHERE (:date_from IS NULL OR a.date >= :date_from) AND (:date_to IS NULL OR a.date <= :date_to)
+        ORDER BY a.date, a.id
+    """).columns(date=db.Date, check_in=db.Time, check_out=db.Time)
+    rows = conn.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(statement, {
+        'date_from': date_from.isoformat() if date_from else None,
+        'date_to': date_to.isoformat() if date_to else None
+    })
+
+    count = 0
+    for row in rows:
+        ws.append([
+            row.employee_id,
+            f"{row.first_name} {row.last_name}",
+            row.department,
+            row.date,
+            row.check_in,
+            row.check_out,
+            row.status,
+            row.overtime_hours,
+            row.remarks
+        ])
+        count += 1
+    return count
+
+
+@app.route('/admin/reports/export/detailed', methods=['POST'])
+@login_required
+@admin_required
+@reads_reporting_snapshot
+def export_excel_detailed():
+    """Export every leave and attendance row as Excel, with bounded memory"""
+    date_from = request.form.get('date_from')
+    date_to = request.form.get('date_to')
+
+    try:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        flash('Invalid date format!', 'danger')
+        return redirect(url_for('admin_reports'))
+
+    # Write-only mode flushes each row to disk instead of keeping cells in memory
+    wb = Workbook(write_only=True)
+
+    ws_summary = wb.create_sheet(title="Summary")
+    ws_leaves = wb.create_sheet(title="Leaves")
+    ws_attendance = wb.create_sheet(title="Attendance")
+
+    leave_count = write_leave_detail_rows(ws_leaves, date_from, date_to)
+    attendance_count = write_attendance_detail_rows(ws_attendance, date_from, date_to)
+
+    ws_summary.append(['TextileLeave Pro - Detailed Export'])
+    ws_summary.append(['Generated on:', datetime.now()])
+    ws_summary.append(['From:', date_from or 'All'])
+    ws_summary.append(['To:', date_to or 'All'])
+    ws_summary.append([])
+    ws_summary.append(['Leave Rows', leave_count])
+    ws_summary.append(['Attendance Rows', attendance_count])
+
+    # Save to an anonymous temporary file and stream it; the file is
+    # deleted when the response closes it
+    excel_file = tempfile.TemporaryFile(suffix='.xlsx')
+    wb.save(excel_file)
+    excel_file.seek(0)
+
+    return send_file(
+        excel_file,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'textileleave_detailed_{date.today().strftime("%Y%m%d")}.xlsx'
+    )
+
+
 def export_json(attendance_summary, leave_summary, dept_summary, monthly_trend,
                 total_employees, present_days, approved_leaves, attendance_rate):
     """Export data as JSON file"""
@@ -1133,7 +3150,7 @@ def export_pdf(attendance_summary, leave_summary, dept_summary, monthly_trend,
     try:
         # Try to import reportlab if available
         from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
         from reportlab.lib.styles import getSampleStyleSheet
         from reportlab.lib import colors
         from reportlab.lib.units import inch
@@ -1172,6 +3189,13 @@ def export_pdf(attendance_summary, leave_summary, dept_summary, monthly_trend,
         elements.append(summary_table)
         elements.append(Spacer(1, 20))
 
+        # Charts, from the same cached PNGs the reports page shows
+        chart_paths = report_chart_paths(leave_summary, dept_summary, monthly_trend)
+        for name, title in CHART_TITLES.items():
+            elements.append(Paragraph(f"<b>{title.upper()}</b>", styles['Heading2']))
+            elements.append(Image(chart_paths[name], width=6 * inch, height=3.5 * inch))
+            elements.append(Spacer(1, 20))
+
         # Build the PDF
         doc.build(elements)
         pdf_buffer.seek(0)
@@ -1204,9 +3228,154 @@ Install with: pip install reportlab
         return response
 
 
+app.config['CHART_CACHE_DIR'] = os.path.join(BASE_DIR, 'cache', 'charts')
+# Bump when chart styling changes so cached PNGs are redrawn
+CHART_VERSION = 1
+# PNGs kept per chart; older fingerprints are pruned
+CHART_CACHE_KEEP = 20
+CHART_TITLES = {
+    'trend': 'Attendance Trend (Last 6 Months)',
+    'leave_mix': 'Approved Leaves by Type',
+    'departments': 'Department Distribution'
+}
+
+
+def chart_inputs(leave_summary, dept_summary, monthly_trend):
+    """Plain, JSON-serialisable chart data taken from the report aggregates"""
+    return {
+        'trend': [[month['month'], int(month['present']), round(float(month['rate']), 2)]
+                  for month in monthly_trend],
+        'leave_mix': [[leave_type, int(count), int(total_days or 0)]
+                      for leave_type, count, total_days in leave_summary],
+        'departments': [[department or 'Not Specified', int(count)]
+                        for department, count in dept_summary]
+    }
+
+
+def chart_fingerprint(name, rows):
+    payload = json.dumps([CHART_VERSION, name, rows], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def chart_path(name, fingerprint):
+    return os.path.join(app.config['CHART_CACHE_DIR'], f'{name}_{fingerprint}.png')
+
+
+def _draw_trend(ax, rows):
+    months = [month for month, _, _ in rows]
+    ax.bar(months, [present for _, present, _ in rows], color='#4e73df')
+    ax.set_ylabel('Present days')
+    rate_ax = ax.twinx()
+    rate_ax.plot(months, [rate for _, _, rate in rows], color='#1cc88a', marker='o')
+    rate_ax.set_ylim(0, 100)
+    rate_ax.set_ylabel('Attendance rate (%)')
+
+
+def _draw_leave_mix(ax, rows):
+    ax.pie([count for _, count, _ in rows],
+           labels=[f"{leave_type} ({total_days} days)" for leave_type, _, total_days in rows],
+           autopct='%1.0f%%', startangle=90)
+    ax.axis('equal')
+
+
+def _draw_departments(ax, rows):
+    ax.barh([department for department, _ in rows], [count for _, count in rows], color='#36b9cc')
+    ax.invert_yaxis()
+    ax.set_xlabel('Employees')
+
+
+CHART_RENDERERS = {
+    'trend': _draw_trend,
+    'leave_mix': _draw_leave_mix,
+    'departments': _draw_departments
+}
+
+
+def render_chart(name, rows, path):
+    """Draw a chart with the Agg backend and write it atomically to path"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    # A bare Figure (no pyplot) keeps rendering free of global state
+    fig = Figure(figsize=(6, 3.5), dpi=100)
+    ax = fig.add_subplot()
+    ax.set_title(CHART_TITLES[name])
+    if rows:
+        CHART_RENDERERS[name](ax, rows)
+    else:
+        ax.axis('off')
+        ax.text(0.5, 0.5, 'No data', ha='center', va='center', color='grey')
+    fig.tight_layout()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    fig.savefig(temp_path, format='png')
+    os.replace(temp_path, path)
+
+    # Prune older fingerprints of this chart
+    prefix = f'{name}_'
+    cached = sorted(
+        (entry for entry in os.scandir(os.path.dirname(path))
+         if entry.name.startswith(prefix) and entry.name.endswith('.png')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in cached[CHART_CACHE_KEEP:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def ensure_report_charts(leave_summary, dept_summary, monthly_trend):
+    """Render any chart whose data changed; return {name: fingerprint}"""
+    fingerprints = {}
+    for name, rows in chart_inputs(leave_summary, dept_summary, monthly_trend).items():
+        fingerprint = chart_fingerprint(name, rows)
+        path = chart_path(name, fingerprint)
+        if not os.path.exists(path):
+            render_chart(name, rows, path)
+        fingerprints[name] = fingerprint
+    return fingerprints
+
+
+def report_chart_fingerprints(report_data):
+    return ensure_report_charts(report_data['leave_summary'],
+                                report_data['dept_summary'],
+                                report_data['monthly_trend'])
+
+
+def report_chart_paths(leave_summary, dept_summary, monthly_trend):
+    fingerprints = ensure_report_charts(leave_summary, dept_summary, monthly_trend)
+    return {name: chart_path(name, fingerprint) for name, fingerprint in fingerprints.items()}
+
+
+@app.route('/admin/reports/chart/<name>/<fingerprint>.png')
+@login_required
+@admin_required
+def report_chart(name, fingerprint):
+    if name not in CHART_RENDERERS or not all(ch in '0123456789abcdef' for ch in fingerprint):
+        return "Unknown chart", 404
+
+    path = chart_path(name, fingerprint)
+    if not os.path.exists(path):
+        # Pruned or stale: point the client at the chart for current data
+        current = report_chart_fingerprints(collect_report_data())[name]
+        return redirect(url_for('report_chart', name=name, fingerprint=current))
+
+    # The URL is content-addressed, so the image never changes
+    response = send_file(path, mimetype='image/png', etag=fingerprint, conditional=True, max_age=86400)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/admin/report', methods=['POST'])
 @login_required
 @admin_required
+@reads_reporting_snapshot
 def export_report():
     """Alternative route for exporting reports"""
     format_type = request.form.get('format', 'csv')
@@ -1236,6 +3405,544 @@ def export_report():
         return export_pdf(attendance_summary, [], [], [], 0, 0, 0, 0)
     else:
         return export_csv(attendance_summary, [], [], [], 0, 0, 0, 0)
+
+
+import numpy as np
+
+# Department x day heatmaps, keyed by (site, year) -> (version, heatmap). Each
+# worker rebuilds its copy once leave_heatmap_version() moves, so approvals
+# and department changes made through any worker show up everywhere.
+_heatmap_cache = {}
+
+# Years the heatmap can be asked for, relative to the current year
+HEATMAP_YEARS_BACK = 50
+HEATMAP_YEARS_AHEAD = 5
+
+
+def requested_year(years_back, years_ahead):
+    """?year= clamped to a range around the current year; the current year if missing or not a number"""
+    this_year = date.today().year
+    year = request.args.get('year', type=int)
+    if year is None:
+        return this_year
+    return min(max(year, this_year - years_back), this_year + years_ahead)
+
+
+def requested_heatmap_year():
+    return requested_year(HEATMAP_YEARS_BACK, HEATMAP_YEARS_AHEAD)
+
+
+def leave_heatmap_version(year):
+    """Change stamps of the rows a year's heatmap is built from.
+
+    change_seq moves whenever a leave touching the year or one of the
+    employees with an approved leave in it is inserted or updated, by any
+    worker; the count catches leaves disappearing from the year.
+    """
+    row = db.session.execute(db.text("""
+        SELECT (SELECT MAX(change_seq) FROM leave
+                WHERE start_date <= :year_end AND end_date >= :year_start) AS leave_seq,
+               (SELECT COUNT(*) FROM leave
+                WHERE start_date <= :year_end AND end_date >= :year_start) AS leave_count,
+               (SELECT MAX(u.change_seq) FROM user u
+                WHERE u.id IN (SELECT user_id FROM leave WHERE status = 'Approved'
+                               AND start_date <= :year_end AND end_date >= :year_start)) AS user_seq
+    """), {'year_start': date(year, 1, 1).isoformat(), 'year_end': date(year, 12, 31).isoformat()}).one()
+    return tuple(row)
+
+
+def build_leave_heatmap(year):
+    """Count approved leaves per department per day for a year"""
+    cache_key = (current_site(), year)
+    version = leave_heatmap_version(year)
+    cached = _heatmap_cache.get(cache_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    year_start = date(year, 1, 1)
+    year_end = date(year, 12, 31)
+    num_days = (year_end - year_start).days + 1
+
+    # Load every approved interval touching the year in one query
+    intervals = db.session.query(
+        User.department,
+        Leave.start_date,
+        Leave.end_date
+    ).join(User, Leave.user_id == User.id).filter(
+        Leave.status == 'Approved',
+        Leave.start_date <= year_end,
+        Leave.end_date >= year_start
+    ).all()
+
+    departments = sorted({department or 'Not Specified' for department, _, _ in intervals})
+    dept_index = {department: i for i, department in enumerate(departments)}
+
+    # Difference array: +1 on the first day, -1 on the day after the last,
+    # then a running sum along each row gives the daily head count
+    diff = np.zeros((len(departments), num_days + 1), dtype=np.int32)
+    if intervals:
+        rows = np.array([dept_index[department or 'Not Specified'] for department, _, _ in intervals])
+        starts = np.array([max((start - year_start).days, 0) for _, start, _ in intervals])
+        ends = np.array([min((end - year_start).days, num_days - 1) for _, _, end in intervals])
+        np.add.at(diff, (rows, starts), 1)
+        np.add.at(diff, (rows, ends + 1), -1)
+    matrix = np.cumsum(diff[:, :-1], axis=1)
+
+    heatmap = {
+        'year': year,
+        'start_date': year_start,
+        'departments': departments,
+        'matrix': matrix,
+        'max_count': int(matrix.max()) if matrix.size else 0
+    }
+    _heatmap_cache[cache_key] = (version, heatmap)
+    return heatmap
+
+
+@app.route('/admin/reports/heatmap')
+@login_required
+@admin_required
+def admin_leave_heatmap():
+    year = requested_heatmap_year()
+    heatmap = build_leave_heatmap(year)
+
+    # Group the day columns by month for the template header
+    months = []
+    offset = 0
+    for month in range(1, 13):
+        days_in_month = calendar.monthrange(year, month)[1]
+        months.append({
+            'name': calendar.month_abbr[month],
+            'start': offset,
+            'days': days_in_month
+        })
+        offset += days_in_month
+
+    department_names = db.session.query(User.department).filter(
+        User.department.isnot(None)
+    ).distinct().order_by(User.department)
+    calendar_feeds = [(name, calendar_feed_url('department', name)) for name, in department_names]
+
+    return render_template('admin/heatmap.html',
+                           year=year,
+                           calendar_feeds=calendar_feeds,
+                           departments=heatmap['departments'],
+                           matrix=heatmap['matrix'].tolist(),
+                           max_count=heatmap['max_count'],
+                           months=months)
+
+
+@app.route('/api/reports/heatmap')
+@login_required
+@admin_required
+def leave_heatmap_data():
+    year = requested_heatmap_year()
+    heatmap = build_leave_heatmap(year)
+
+    return jsonify({
+        'year': year,
+        'start_date': heatmap['start_date'].isoformat(),
+        'departments': heatmap['departments'],
+        'max_count': heatmap['max_count'],
+        'matrix': heatmap['matrix'].tolist()
+    })
+
+
+# iCalendar feeds of approved leaves, per employee and per department. Calendar
+# apps poll them with a signed token instead of a login. The ETag comes from the
+# change-tracking columns of the rows a feed is built from, so every worker
+# agrees on it without being told about changes, and most polls are answered
+# with a 304 after one small query.
+_calendar_serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='leave-calendar')
+
+# Rendered feeds keyed by (site, kind, key) -> (etag, body), reused while the etag holds
+_calendar_cache = {}
+
+
+def calendar_feed_url(kind, key):
+    token = _calendar_serializer.dumps([current_site(), kind, key])
+    return url_for('leave_calendar_feed', kind=kind, token=token, _external=True)
+
+
+def ical_text(value):
+    """Escape a TEXT value (RFC 5545 3.3.11)"""
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ical_content(lines):
+    """Join content lines with CRLF, folding each at 75 octets"""
+    folded = []
+    for line in lines:
+        encoded = line.encode('utf-8')
+        while len(encoded) > 75:
+            cut = 75
+            # Never split a multi-byte character
+            while encoded[cut] & 0xC0 == 0x80:
+                cut -= 1
+            folded.append(encoded[:cut])
+            encoded = b' ' + encoded[cut:]
+        folded.append(encoded)
+    return b'\r\n'.join(folded) + b'\r\n'
+
+
+def build_leave_calendar(kind, key):
+    """Render an employee's or a department's approved leaves; None if unknown"""
+    if kind == 'employee':
+        employee = db.session.get(User, key)
+        if employee is None or not employee.is_active:
+            return None
+        title = f'{employee.get_full_name()} - Leave'
+    else:
+        title = f'{key} - Team Leave'
+
+    window_start = date.today() - timedelta(days=app.config['CALENDAR_FEED_PAST_DAYS'])
+    query = db.session.query(
+        Leave.id,
+        Leave.leave_type,
+        Leave.start_date,
+        Leave.end_date,
+        Leave.approved_date,
+        User.first_name,
+        User.last_name
+    ).join(User, Leave.user_id == User.id).filter(
+        Leave.status == 'Approved',
+        Leave.end_date >= window_start
+    )
+    if kind == 'employee':
+        query = query.filter(Leave.user_id == key)
+    else:
+        query = query.filter(User.department == key, User.is_active == True)
+
+    site = current_site()
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//TextileLeave Pro//Leave Calendar//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{ical_text(title)}',
+        'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+        'X-PUBLISHED-TTL:PT1H'
+    ]
+    for leave_id, leave_type, start_date, end_date, approved_date, first_name, last_name in query.order_by(Leave.start_date):
+        summary = f'{leave_type} Leave'
+        if kind == 'department':
+            summary = f'{first_name} {last_name} - {summary}'
+        # DTSTAMP comes from the row, so an unchanged feed renders byte for byte
+        stamp = approved_date or datetime.combine(start_date, datetime.min.time())
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:leave-{site}-{leave_id}@textile-lms',
+            f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+            f"DTSTART;VALUE=DATE:{start_date.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(end_date + timedelta(days=1)).strftime('%Y%m%d')}",
+            f'SUMMARY:{ical_text(summary)}',
+            # Team members' leave shouldn't block out the lead's own calendar
+            'TRANSP:OPAQUE' if kind == 'employee' else 'TRANSP:TRANSPARENT',
+            'END:VEVENT'
+        ]
+    lines.append('END:VCALENDAR')
+    return ical_content(lines)
+
+
+def leave_calendar_tag(kind, key):
+    """(etag, last_modified) of a feed from its rows' change stamps; None if unknown.
+
+    change_seq moves whenever one of the leaves or employees is inserted or
+    updated by any worker, the counts catch employees leaving a department,
+    and the window start moves the tag once a day as old leaves drop out.
+    """
+    window_start = date.today() - timedelta(days=app.config['CALENDAR_FEED_PAST_DAYS'])
+    if kind == 'employee':
+        leaves = 'SELECT change_seq, updated_at FROM leave WHERE user_id = :key AND end_date >= :window_start'
+        users = 'SELECT change_seq, updated_at FROM user WHERE id = :key AND is_active = 1'
+    else:
+        leaves = ('SELECT l.change_seq, l.updated_at FROM leave l JOIN user u ON u.id = l.user_id '
+                  'WHERE u.department = :key AND l.end_date >= :window_start')
+        users = 'SELECT change_seq, updated_at FROM user WHERE department = :key'
+    row = db.session.execute(db.text(f"""
+        SELECT l.seq AS leave_seq, l.n AS leave_count, l.updated AS leave_updated,
+               u.seq AS user_seq, u.n AS user_count, u.updated AS user_updated
+        FROM (SELECT MAX(change_seq) AS seq, COUNT(*) AS n, MAX(updated_at) AS updated FROM ({leaves})) l,
+             (SELECT MAX(change_seq) AS seq, COUNT(*) AS n, MAX(updated_at) AS updated FROM ({users})) u
+    """), {'key': key, 'window_start': window_start.isoformat()}).one()
+    if kind == 'employee' and not row.user_count:
+        return None
+
+    version = (current_site(), kind, key, window_start.isoformat(),
+               row.leave_seq, row.leave_count, row.user_seq, row.user_count)
+    # Never earlier than today, when the window last moved
+    stamps = [datetime.fromisoformat(value) for value in (row.leave_updated, row.user_updated) if value]
+    last_modified = max(stamps + [datetime.combine(date.today(), datetime.min.time())]).replace(microsecond=0)
+    return hashlib.sha1(repr(version).encode()).hexdigest(), last_modified
+
+
+def leave_calendar_body(kind, key, etag):
+    """This worker's rendered feed for etag, rebuilt if it has none or an older one"""
+    cache_key = (current_site(), kind, key)
+    cached = _calendar_cache.get(cache_key)
+    if cached and cached[0] == etag:
+        return cached[1]
+
+    body = build_leave_calendar(kind, key)
+    if body is None:
+        _calendar_cache.pop(cache_key, None)
+        return None
+    _calendar_cache[cache_key] = (etag, body)
+    return body
+
+
+@app.route('/calendar/<kind>/<token>.ics')
+def leave_calendar_feed(kind, token):
+    """Subscription feed for calendar apps; the signed token stands in for a login"""
+    try:
+        site, token_kind, key = _calendar_serializer.loads(token)
+    except (BadSignature, ValueError):
+        return "Unknown calendar", 404
+    if token_kind != kind or site not in app.config['SITES']:
+        return "Unknown calendar", 404
+    g.site = site
+
+    tag = leave_calendar_tag(kind, key)
+    if tag is None:
+        return "Unknown calendar", 404
+    etag, last_modified = tag
+
+    body = b''
+    # Revalidations that still match are answered without rendering
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        body = leave_calendar_body(kind, key, etag)
+        if body is None:
+            return "Unknown calendar", 404
+
+    response = make_response(body)
+    response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['CALENDAR_FEED_MAX_AGE']
+    return response.make_conditional(request)
+
+
+# Muster roll codes
+REGISTER_STATUS_CODES = {
+    'Present': 'P',
+    'Absent': 'A',
+    'Late': 'L',
+    'Half-day': 'HD',
+    'On Leave': 'LV'
+}
+REGISTER_LEAVE_CODES = {
+    'Annual': 'AL',
+    'Sick': 'SL',
+    'Casual': 'CL',
+    'Emergency': 'EL'
+}
+REGISTER_WEEKLY_OFF = 'WO'
+# Years the register can be asked for, relative to the current year
+REGISTER_YEARS_BACK = 50
+REGISTER_YEARS_AHEAD = 1
+
+
+def build_attendance_register(year, month, department=None):
+    """Build the employee x day muster roll for a month as a DataFrame"""
+    month_start = date(year, month, 1)
+    num_days = calendar.monthrange(year, month)[1]
+    month_end = date(year, month, num_days)
+
+    employee_query = db.session.query(
+        User.id,
+        User.employee_id,
+        User.first_name,
+        User.last_name,
+        User.department
+    ).filter(
+        User.is_admin == False,
+        User.is_active == True
+    )
+    if department:
+        employee_query = employee_query.filter(User.department == department)
+
+    employees = pd.DataFrame(
+        employee_query.order_by(User.department, User.employee_id).all(),
+        columns=['id', 'employee_id', 'first_name', 'last_name', 'department']
+    )
+    employee_index = pd.Index(employees['id'])
+
+    # One column-projected query for the whole month; closed years live in archive files
+    if is_archived_year(year):
+        conn = columnar_connection()
+        view = attendance_history_view([year], conn=conn)
+        attendance_rows = conn.execute(db.text(
+            f"SELECT user_id, date, status FROM {view} WHERE date >= :month_start AND date <= :month_end"
+        ), {'month_start': month_start.isoformat(), 'month_end': month_end.isoformat()}).all()
+    else:
+        attendance_rows = db.session.query(
+            Attendance.user_id,
+            Attendance.date,
+            Attendance.status
+        ).filter(
+            Attendance.date >= month_start,
+            Attendance.date <= month_end
+        ).all()
+    attendance = pd.DataFrame(attendance_rows, columns=['user_id', 'date', 'status'])
+
+    grid = np.full((len(employees), num_days), '', dtype=object)
+
+    if not attendance.empty:
+        rows = employee_index.get_indexer(attendance['user_id'])
+        cols = pd.to_datetime(attendance['date']).dt.day.to_numpy() - 1
+        codes = attendance['status'].map(REGISTER_STATUS_CODES).fillna(attendance['status']).to_numpy()
+        known = rows >= 0
+        grid[rows[known], cols[known]] = codes[known]
+
+    # Saturdays and Sundays without a record are weekly offs
+    weekend = np.array([date(year, month, day).weekday() >= 5 for day in range(1, num_days + 1)])
+    grid[(grid == '') & weekend] = REGISTER_WEEKLY_OFF
+
+    # Overlay approved leave on working days without attendance or marked absent
+    leaves = pd.DataFrame(
+        db.session.query(
+            Leave.user_id,
+            Leave.leave_type,
+            Leave.start_date,
+            Leave.end_date
+        ).filter(
+            Leave.status == 'Approved',
+            Leave.start_date <= month_end,
+            Leave.end_date >= month_start
+        ).all(),
+        columns=['user_id', 'leave_type', 'start_date', 'end_date']
+    )
+
+    if not leaves.empty:
+        rows = employee_index.get_indexer(leaves['user_id'])
+        first = np.array([max(start, month_start).day - 1 for start in leaves['start_date']])
+        last = np.array([min(end, month_end).day - 1 for end in leaves['end_date']])
+        codes = leaves['leave_type'].map(REGISTER_LEAVE_CODES).fillna('LV').to_numpy()
+
+        # Expand each interval into one (row, day) pair per covered day
+        lengths = last - first + 1
+        leave_rows = np.repeat(rows, lengths)
+        leave_cols = np.repeat(first, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+        leave_codes = np.repeat(codes, lengths)
+
+        known = leave_rows >= 0
+        leave_rows, leave_cols, leave_codes = leave_rows[known], leave_cols[known], leave_codes[known]
+        overridable = np.isin(grid[leave_rows, leave_cols], ['', REGISTER_STATUS_CODES['Absent']])
+        grid[leave_rows[overridable], leave_cols[overridable]] = leave_codes[overridable]
+
+    register = pd.DataFrame(grid, columns=[str(day) for day in range(1, num_days + 1)])
+    register.insert(0, 'Employee ID', employees['employee_id'])
+    register.insert(1, 'Name', employees['first_name'] + ' ' + employees['last_name'])
+    register.insert(2, 'Department', employees['department'].fillna('Not Specified'))
+
+    leave_codes = list(REGISTER_LEAVE_CODES.values()) + [REGISTER_STATUS_CODES['On Leave']]
+    register['Present'] = (grid == 'P').sum(axis=1)
+    register['Late'] = (grid == 'L').sum(axis=1)
+    register['Half-day'] = (grid == 'HD').sum(axis=1)
+    register['Leave'] = np.isin(grid, leave_codes).sum(axis=1)
+    register['Absent'] = (grid == 'A').sum(axis=1)
+
+    return register
+
+
+def export_register_pdf(register, year, month):
+    """Export the muster roll as a landscape PDF, one table per page"""
+    from reportlab.lib.pagesizes import A3, landscape
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib import colors
+
+    pdf_buffer = BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=landscape(A3),
+                            leftMargin=20, rightMargin=20, topMargin=20, bottomMargin=20)
+    styles = getSampleStyleSheet()
+    elements = [
+        Paragraph(f"<b>Attendance Register - {calendar.month_name[month]} {year}</b>", styles['Title']),
+        Spacer(1, 10)
+    ]
+
+    header = list(register.columns)
+    body = register.astype(str).values.tolist()
+    rows_per_page = 45
+    style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 6),
+        ('ALIGN', (3, 0), (-1, -1), 'CENTER'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.black)
+    ])
+
+    for offset in range(0, max(len(body), 1), rows_per_page):
+        if offset:
+            elements.append(PageBreak())
+        table = Table([header] + body[offset:offset + rows_per_page])
+        table.setStyle(style)
+        elements.append(table)
+
+    doc.build(elements)
+    pdf_buffer.seek(0)
+    return pdf_buffer
+
+
+@app.route('/admin/reports/register')
+@login_required
+@admin_required
+@reads_reporting_snapshot
+def attendance_register():
+    year = requested_year(REGISTER_YEARS_BACK, REGISTER_YEARS_AHEAD)
+    month = request.args.get('month', date.today().month, type=int)
+    department = request.args.get('department') or None
+    format_type = request.args.get('format', 'html')
+
+    if not 1 <= month <= 12:
+        month = date.today().month
+
+    register = build_attendance_register(year, month, department)
+    filename = f'attendance_register_{year}_{month:02d}'
+
+    if format_type == 'csv':
+        response = make_response(register.to_csv(index=False))
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+        response.headers['Content-type'] = 'text/csv'
+        return response
+    elif format_type == 'excel':
+        excel_file = BytesIO()
+        register.to_excel(excel_file, index=False, sheet_name=f'{calendar.month_abbr[month]} {year}')
+        excel_file.seek(0)
+        return send_file(
+            excel_file,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'{filename}.xlsx'
+        )
+    elif format_type == 'pdf':
+        return send_file(
+            export_register_pdf(register, year, month),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'{filename}.pdf'
+        )
+
+    num_days = calendar.monthrange(year, month)[1]
+    return render_template('admin/register.html',
+                           year=year,
+                           month=month,
+                           month_name=calendar.month_name[month],
+                           department=department,
+                           departments=[name for (name,) in db.session.query(User.department).filter(
+                               User.is_admin == False, User.department != None).distinct().order_by(User.department)],
+                           columns=list(register.columns),
+                           rows=register.values.tolist(),
+                           weekend_days=[day for day in range(1, num_days + 1)
+                                         if date(year, month, day).weekday() >= 5],
+                           status_codes=REGISTER_STATUS_CODES,
+                           leave_codes=REGISTER_LEAVE_CODES)
+
+
 @app.route('/mark_attendance', methods=['POST'])
 @login_required
 @admin_required
@@ -1253,6 +3960,12 @@ def mark_attendance():
         flash('Invalid date format!', 'danger')
         return redirect(url_for('admin_attendance'))
 
+    # Closed years live in archive files; writing here would put rows back in
+    # the live table (and attaching the archive mid-transaction can fail)
+    if is_archived_year(attendance_date.year):
+        flash(f'Attendance for {attendance_date.year} is archived and can no longer be changed.', 'danger')
+        return redirect(url_for('admin_attendance'))
+
     # Check if employee exists
     employee = User.query.get(employee_id)
     if not employee:
@@ -1288,11 +4001,338 @@ def mark_attendance():
     attendance.remarks = remarks
 
     db.session.add(attendance)
+    db.session.flush()
+    compute_attendance_hours(attendance_date, attendance_date, user_ids=[attendance.user_id])
+    refresh_attendance_bitmaps(attendance_date.year, attendance_date.month, user_ids=[attendance.user_id])
     db.session.commit()
 
     flash('Attendance marked successfully!', 'success')
     return redirect(url_for('admin_attendance', date=date_str))
 
+# Shift start and standard hours, matching the shifts offered on the profile page
+SHIFT_SCHEDULES = {
+    'Morning': {'start': '06:00', 'hours': 8.0},
+    'Evening': {'start': '14:00', 'hours': 8.0},
+    'Night': {'start': '22:00', 'hours': 8.0},
+    'General': {'start': '09:00', 'hours': 8.0}
+}
+DEFAULT_SHIFT = 'General'
+
+
+def _minutes_of_day(values):
+    """Times of day as float minutes since midnight, NaN where missing"""
+    return np.array([
+        value.hour * 60 + value.minute + value.second / 60 if value is not None else np.nan
+        for value in values
+    ], dtype=float)
+
+
+def compute_attendance_hours(start_date, end_date, user_ids=None, chunk_size=5000):
+    """Derive worked and overtime hours for attendance in a date range.
+
+    Rows are read column-projected in id-ordered chunks, computed with NumPy
+    in one pass per chunk and written back with a bulk update. Only rows
+    whose values change are written, so re-running a range is cheap.
+    Returns the number of rows updated.
+    """
+    rounding = app.config['OVERTIME_ROUNDING_MINUTES']
+    standard_hours = {shift: schedule['hours'] for shift, schedule in SHIFT_SCHEDULES.items()}
+    updated = 0
+    last_id = 0
+
+    while True:
+        query = db.session.query(
+            Attendance.id,
+            Attendance.check_in,
+            Attendance.check_out,
+            Attendance.worked_hours,
+            Attendance.overtime_hours,
+            User.shift
+        ).join(User, Attendance.user_id == User.id).filter(
+            Attendance.date >= start_date,
+            Attendance.date <= end_date,
+            Attendance.id > last_id
+        )
+        if user_ids is not None:
+            query = query.filter(Attendance.user_id.in_(user_ids))
+
+        rows = query.order_by(Attendance.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        ids, check_ins, check_outs, old_worked, old_overtime, shifts = zip(*rows)
+        check_in = _minutes_of_day(check_ins)
+        check_out = _minutes_of_day(check_outs)
+
+        # A check-out earlier than check-in means the shift crossed midnight
+        worked = check_out - check_in
+        worked = np.where(worked < 0, worked + 24 * 60, worked)
+        worked = np.nan_to_num(worked, nan=0.0)
+
+        shift_hours = np.array([
+            standard_hours.get(shift, standard_hours[DEFAULT_SHIFT]) for shift in shifts
+        ])
+        overtime = np.maximum(worked - shift_hours * 60, 0)
+        overtime = np.floor(overtime / rounding) * rounding
+
+        worked_hours = np.round(worked / 60, 2)
+        overtime_hours = np.round(overtime / 60, 2)
+
+        old_worked = np.array([value or 0 for value in old_worked], dtype=float)
+        old_overtime = np.array([value or 0 for value in old_overtime], dtype=float)
+        changed = np.flatnonzero((worked_hours != old_worked) | (overtime_hours != old_overtime))
+
+        if changed.size:
+            db.session.bulk_update_mappings(Attendance, [
+                {
+                    'id': ids[i],
+                    'worked_hours': float(worked_hours[i]),
+                    'overtime_hours': float(overtime_hours[i])
+                }
+                for i in changed
+            ])
+            updated += int(changed.size)
+
+        if len(rows) < chunk_size:
+            break
+
+    return updated
+
+
+@app.cli.command('compute-attendance-hours')
+@click.option('--start', 'start_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First date to compute (default: yesterday).')
+@click.option('--end', 'end_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last date to compute (default: same as --start).')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows computed per batch.')
+def compute_attendance_hours_command(start_date, end_date, chunk_size):
+    """Backfill worked and overtime hours from check-in/check-out times."""
+    start = start_date.date() if start_date else date.today() - timedelta(days=1)
+    end = end_date.date() if end_date else start
+
+    updated = compute_attendance_hours(start, end, chunk_size=chunk_size)
+    db.session.commit()
+    print(f"✅ Worked/overtime hours updated for {updated} attendance rows ({start} to {end})")
+
+
+# Every shift works Monday to Friday until the roster is edited
+DEFAULT_ROSTER_WEEKDAYS = range(5)
+AUTO_ABSENT_REMARK = 'Auto-marked: no attendance recorded'
+
+MARK_ABSENTEES_SQL = """
+    INSERT INTO attendance (user_id, date, status, worked_hours, overtime_hours, remarks)
+    SELECT u.id, :day,
+           CASE WHEN on_leave.user_id IS NULL THEN 'Absent' ELSE 'On Leave' END,
+           0, 0, :remark
+    FROM user u
+    LEFT JOIN (
+        SELECT DISTINCT user_id FROM leave
+        WHERE status = 'Approved' AND start_date <= :day AND end_date >= :day
+    ) on_leave ON on_leave.user_id = u.id
+    WHERE u.is_admin = 0 AND u.is_active = 1 AND u.date_of_joining <= :day
+      AND COALESCE(u.shift, :default_shift) = :shift
+      AND NOT EXISTS (SELECT 1 FROM attendance a WHERE a.user_id = u.id AND a.date = :day)
+"""
+
+
+def ensure_shift_roster():
+    """Roster every scheduled shift on the default weekdays if no roster exists yet"""
+    if ShiftRoster.query.first():
+        return False
+    db.session.add_all(ShiftRoster(shift=shift, weekday=weekday)
+                       for shift in SHIFT_SCHEDULES for weekday in DEFAULT_ROSTER_WEEKDAYS)
+    db.session.commit()
+    return True
+
+
+def mark_absentees(day):
+    """Give rostered employees with no attendance for the day an 'Absent' row,
+    or 'On Leave' where an approved leave covers it.
+
+    One INSERT ... SELECT per shift rostered on that weekday; employees
+    without a shift follow the default shift. Rows already recorded are
+    never touched, so the job can be re-run. Returns rows added per shift;
+    the caller commits.
+    """
+    shifts = [shift for (shift,) in db.session.query(ShiftRoster.shift)
+              .filter_by(weekday=day.weekday()).order_by(ShiftRoster.shift)]
+    marked = {}
+    for shift in shifts:
+        result = db.session.execute(db.text(MARK_ABSENTEES_SQL), {
+            'day': day.isoformat(),
+            'shift': shift,
+            'default_shift': DEFAULT_SHIFT,
+            'remark': AUTO_ABSENT_REMARK
+        })
+        marked[shift] = result.rowcount
+    if any(marked.values()):
+        refresh_attendance_day_bitmaps(day)
+    return marked
+
+
+@app.cli.command('mark-absentees')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Day to close (default: yesterday, so night shifts have finished).')
+@click.option('--days', default=1, show_default=True, help='Number of days ending at --date.')
+def mark_absentees_command(day, days):
+    """Mark rostered employees without attendance as Absent or On Leave."""
+    last = day.date() if day else date.today() - timedelta(days=1)
+    for offset in range(days - 1, -1, -1):
+        current = last - timedelta(days=offset)
+        started = time.perf_counter()
+        marked = mark_absentees(current)
+        db.session.commit()
+        summary = ', '.join(f'{shift}: {count}' for shift, count in marked.items()) or 'no shifts rostered'
+        print(f"✅ {current}: {sum(marked.values())} rows marked ({summary}) "
+              f"in {time.perf_counter() - started:.2f}s")
+
+
+# Attendance bitmaps: a secondary store with one row per employee-month and a
+# day bitmap per status, so counts are popcounts instead of row scans
+BITMAP_STATUS_COLUMNS = {
+    'Present': 'present',
+    'Absent': 'absent',
+    'Late': 'late',
+    'Half-day': 'half_day',
+    'On Leave': 'on_leave'
+}
+# Set bits in every byte value, for popcounts over whole arrays
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Set bits per element of an array of day bitmaps"""
+    values = np.ascontiguousarray(values, dtype=np.uint32)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 4).sum(axis=1, dtype=np.int64)
+
+
+def refresh_attendance_bitmaps(year, month=None, user_ids=None):
+    """Rebuild the bitmaps of a month (or whole year) from attendance rows.
+
+    One DELETE and one INSERT ... SELECT; a bit is set for each day that has
+    a row with that status. Archived years are read through the history
+    view. The caller commits.
+    """
+    start = date(year, month or 1, 1)
+    end = date(year + 1, 1, 1) if month in (None, 12) else date(year, month + 1, 1)
+    source = attendance_history_view([year]) if is_archived_year(year) else 'attendance'
+
+    scope = 'year = :year' + (' AND month = :month' if month else '')
+    users = ' AND user_id IN :user_ids' if user_ids is not None else ''
+    day_bit = "1 << (CAST(strftime('%d', date) AS INTEGER) - 1)"
+    bitmaps = ', '.join(f"SUM(DISTINCT CASE WHEN status = '{status}' THEN {day_bit} ELSE 0 END)"
+                        for status in BITMAP_STATUS_COLUMNS)
+
+    params = {'year': year, 'month': month, 'start': start.isoformat(), 'end': end.isoformat()}
+    delete = db.text(f'DELETE FROM attendance_bitmap WHERE {scope}{users}')
+    insert = db.text(f"""
+        INSERT INTO attendance_bitmap (user_id, year, month, {', '.join(BITMAP_STATUS_COLUMNS.values())})
+        SELECT user_id, :year, CAST(strftime('%m', date) AS INTEGER), {bitmaps}
+        FROM {source}
+        WHERE date >= :start AND date < :end{users}
+        GROUP BY user_id, strftime('%m', date)
+    """)
+    if user_ids is not None:
+        params['user_ids'] = list(user_ids)
+        delete = delete.bindparams(db.bindparam('user_ids', expanding=True))
+        insert = insert.bindparams(db.bindparam('user_ids', expanding=True))
+
+    db.session.execute(delete, params)
+    return db.session.execute(insert, params).rowcount
+
+
+def refresh_attendance_day_bitmaps(day):
+    """Set one day's bits from that day's attendance rows, leaving other days alone"""
+    columns = list(BITMAP_STATUS_COLUMNS.values())
+    day_bits = ', '.join(f"MAX(CASE WHEN status = '{status}' THEN :bit ELSE 0 END)"
+                         for status in BITMAP_STATUS_COLUMNS)
+    updates = ', '.join(f'{column} = ({column} & ~:bit) | excluded.{column}' for column in columns)
+    db.session.execute(db.text(f"""
+        INSERT INTO attendance_bitmap (user_id, year, month, {', '.join(columns)})
+        SELECT user_id, :year, :month, {day_bits}
+        FROM attendance
+        WHERE date = :day
+        GROUP BY user_id
+        ON CONFLICT (user_id, year, month) DO UPDATE SET {updates}
+    """), {'bit': 1 << (day.day - 1), 'year': day.year, 'month': day.month, 'day': day.isoformat()})
+
+
+def archived_attendance_years():
+    directory = os.path.dirname(attendance_archive_path(date.today().year))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[len('attendance_'):-len('.db')]) for name in os.listdir(directory)
+                  if name.startswith('attendance_') and name.endswith('.db'))
+
+
+def rebuild_attendance_bitmaps(years=None):
+    """Rebuild the bitmaps of the given years (default: every live and archived year)"""
+    if not years:
+        live_years = db.session.execute(db.text(
+            "SELECT DISTINCT CAST(strftime('%Y', date) AS INTEGER) FROM attendance"
+        )).scalars().all()
+        years = sorted(set(live_years) | set(archived_attendance_years()))
+    for year in years:
+        refresh_attendance_bitmaps(year)
+        db.session.commit()
+    return years
+
+
+def attendance_counts(user_id, year, month):
+    """Days per status for one employee-month, from its bitmaps"""
+    row = AttendanceBitmap.query.filter_by(user_id=user_id, year=year, month=month).first()
+    return {status: bin(getattr(row, column)).count('1') if row else 0
+            for status, column in BITMAP_STATUS_COLUMNS.items()}
+
+
+def presence_summary(year, department=None):
+    """Days per status for a year: per month and per department, whole plant
+    unless a department is given"""
+    query = db.session.query(
+        AttendanceBitmap.month,
+        User.department,
+        *[getattr(AttendanceBitmap, column) for column in BITMAP_STATUS_COLUMNS.values()]
+    ).join(User, AttendanceBitmap.user_id == User.id).filter(AttendanceBitmap.year == year)
+    if department:
+        query = query.filter(User.department == department)
+    rows = query.all()
+
+    monthly = {status: [0] * 12 for status in BITMAP_STATUS_COLUMNS}
+    departments = {}
+    if not rows:
+        return {'year': year, 'monthly': monthly, 'departments': departments}
+
+    months = np.array([row[0] for row in rows]) - 1
+    department_names = sorted({row[1] or 'Not Specified' for row in rows})
+    department_codes = np.array([department_names.index(row[1] or 'Not Specified') for row in rows])
+    for i, status in enumerate(BITMAP_STATUS_COLUMNS):
+        days = popcount([row[2 + i] for row in rows])
+        monthly[status] = np.bincount(months, weights=days, minlength=12).astype(int).tolist()
+        per_department = np.bincount(department_codes, weights=days, minlength=len(department_names))
+        for name, count in zip(department_names, per_department):
+            departments.setdefault(name, {})[status] = int(count)
+    return {'year': year, 'monthly': monthly, 'departments': departments}
+
+
+@app.route('/admin/attendance/presence')
+@login_required
+@admin_required
+def attendance_presence_summary():
+    year = request.args.get('year', date.today().year, type=int)
+    return jsonify(presence_summary(year, request.args.get('department') or None))
+
+
+@app.cli.command('rebuild-attendance-bitmaps')
+@click.option('--year', 'years', type=int, multiple=True, help='Year to rebuild (repeatable; default: all).')
+def rebuild_attendance_bitmaps_command(years):
+    """Rebuild the attendance bitmap store from attendance rows."""
+    started = time.perf_counter()
+    years = rebuild_attendance_bitmaps(list(years))
+    print(f"✅ Attendance bitmaps rebuilt for {', '.join(map(str, years)) or 'no years'} "
+          f"in {time.perf_counter() - started:.2f}s")
+
+
 @app.route('/user/profile')
 @login_required
 def user_profile():
@@ -1323,16 +4363,32 @@ def user_attendance():
         month = date.today().month
         year = date.today().year
 
-    attendances = Attendance.query.filter_by(user_id=current_user.id) \
-        .filter(db.extract('year', Attendance.date) == year) \
-        .filter(db.extract('month', Attendance.date) == month) \
-        .order_by(Attendance.date).all()
+    if is_archived_year(year):
+        # Closed years live in per-year archive files
+        try:
+            month_start = date(year, month, 1)
+        except ValueError:
+            month_start = date(year, 1, 1)
+        month_end = month_start + timedelta(days=calendar.monthrange(month_start.year, month_start.month)[1])
+        view = attendance_history_view([year])
+        attendances = Attendance.query.from_statement(db.text(
+            f"SELECT * FROM {view} WHERE user_id = :user_id "
+            f"AND date >= :month_start AND date < :month_end ORDER BY date"
+        ).bindparams(user_id=current_user.id,
+                     month_start=month_start.isoformat(),
+                     month_end=month_end.isoformat())).all()
+    else:
+        attendances = Attendance.query.filter_by(user_id=current_user.id) \
+            .filter(db.extract('year', Attendance.date) == year) \
+            .filter(db.extract('month', Attendance.date) == month) \
+            .order_by(Attendance.date).all()
 
     # Calculate statistics
-    present_count = len([a for a in attendances if a.status == 'Present'])
-    absent_count = len([a for a in attendances if a.status == 'Absent'])
-    late_count = len([a for a in attendances if a.status == 'Late'])
-    half_day_count = len([a for a in attendances if a.status == 'Half-day'])
+    counts = attendance_counts(current_user.id, year, month)
+    present_count = counts['Present']
+    absent_count = counts['Absent']
+    late_count = counts['Late']
+    half_day_count = counts['Half-day']
 
     return render_template('user/attendance.html',
                            attendances=attendances,
@@ -1345,13 +4401,740 @@ def user_attendance():
 
 
 
+# Leave policy: yearly allowances from config, pro-rated by joining month,
+# with capped carry-forward written by the year-end job
+LEAVE_TYPES = ['Annual', 'Sick', 'Casual', 'Emergency']
+
+
+def leave_policies():
+    """{leave_type: (days per year, carry-forward cap)}"""
+    caps = app.config['LEAVE_CARRY_FORWARD_CAPS']
+    return {
+        leave_type: (app.config[f'{leave_type.upper()}_LEAVE_DAYS'], caps.get(leave_type, 0))
+        for leave_type in LEAVE_TYPES
+    }
+
+
+def prorated_allowance(days, date_of_joining, year):
+    """Allowance for the months of the year after joining, rounded half-up to half days"""
+    if date_of_joining.year < year:
+        return float(days)
+    if date_of_joining.year > year:
+        return 0.0
+    # Explicit half-up (round() is half-to-even) so this matches _prorated_sql()
+    return int(days * (13 - date_of_joining.month) / 12 * 2 + 0.5) / 2
+
+
+def _days(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def leave_balances(user, year=None):
+    """Available days per leave type: entitlement minus approved and pending days this year"""
+    year = year or date.today().year
+    rows = {
+        balance.leave_type: balance
+        for balance in LeaveBalance.query.filter_by(user_id=user.id, leave_year=year)
+    }
+    used = {}
+    if len(rows) < len(LEAVE_TYPES):
+        used = dict(db.session.query(Leave.leave_type, db.func.sum(Leave.total_days)).filter(
+            Leave.user_id == user.id,
+            Leave.status.in_(['Approved', 'Pending']),
+            Leave.start_date >= date(year, 1, 1),
+            Leave.start_date <= date(year, 12, 31)
+        ).group_by(Leave.leave_type).all())
+
+    balances = {}
+    for leave_type, (days, cap) in leave_policies().items():
+        row = rows.get(leave_type)
+        if row is not None:
+            balances[leave_type] = _days(row.accrued + row.carried_forward - row.taken - row.reserved)
+        else:
+            # Year not opened by the year-end job or a leave application yet
+            entitlement = prorated_allowance(days, user.date_of_joining, year)
+            balances[leave_type] = _days(entitlement - (used.get(leave_type) or 0))
+    return balances
+
+
+# Pending applications hold their days in leave_balance.reserved; approval moves
+# them to taken and rejection releases them. The hold is one conditional UPDATE,
+# so concurrent submissions can't both pass the balance check.
+BALANCE_CHECKED_TYPES = ('Annual', 'Sick')
+LEAVE_BALANCE_COLUMNS = {'Pending': 'reserved', 'Approved': 'taken'}
+
+RESERVE_LEAVE_DAYS_SQL = """
+    UPDATE leave_balance SET reserved = reserved + :days
+    WHERE user_id = :user_id AND leave_year = :year AND leave_type = :leave_type
+      AND (:enforce = 0 OR accrued + carried_forward - taken - reserved >= :days)
+"""
+
+# Balance rows for years the year-end job hasn't opened start from the
+# pro-rated allowance and the leaves already on file
+OPEN_LEAVE_BALANCE_SQL = """
+    INSERT INTO leave_balance (user_id, leave_year, leave_type, accrued, carried_forward, taken, reserved, created_at)
+    SELECT :user_id, :year, :leave_type, :accrued, 0,
+           COALESCE(SUM(CASE WHEN status = 'Approved' THEN total_days END), 0),
+           COALESCE(SUM(CASE WHEN status = 'Pending' THEN total_days END), 0),
+           :now
+    FROM leave
+    WHERE user_id = :user_id AND leave_type = :leave_type
+      AND start_date BETWEEN :year_start AND :year_end
+    ON CONFLICT (user_id, leave_year, leave_type) DO NOTHING
+"""
+
+
+def is_database_locked(error):
+    return isinstance(error.orig, sqlite3.OperationalError) and 'database is locked' in str(error.orig)
+
+
+def begin_immediate():
+    """Start the session's transaction with SQLite's write lock already held.
+
+    A deferred transaction that reads and then writes can deadlock with
+    another writer, and SQLite reports that as "database is locked" right
+    away. BEGIN IMMEDIATE takes the write lock up front, waiting up to the
+    busy timeout for it instead. It does nothing if a transaction has
+    already started, e.g. one that already wrote.
+    """
+    dbapi_connection = db.session.connection().connection.dbapi_connection
+    if not dbapi_connection.in_transaction:
+        dbapi_connection.execute('BEGIN IMMEDIATE')
+
+
+def open_leave_balance(user, leave_type, year):
+    days, cap = leave_policies()[leave_type]
+    db.session.execute(db.text(OPEN_LEAVE_BALANCE_SQL).bindparams(db.bindparam('now', type_=db.DateTime)), {
+        'user_id': user.id, 'year': year, 'leave_type': leave_type,
+        'accrued': prorated_allowance(days, user.date_of_joining, year),
+        'year_start': date(year, 1, 1).isoformat(), 'year_end': date(year, 12, 31).isoformat(),
+        'now': datetime.utcnow()
+    })
+
+
+def reserve_leave_days(user, leave_type, year, days, enforce=True):
+    """Hold days for a new application in the caller's transaction.
+
+    Returns False, holding nothing, if enforce is set and the balance is
+    short. Leave types without a policy aren't tracked.
+    """
+    if leave_type not in LEAVE_TYPES:
+        return True
+    begin_immediate()
+    params = {'user_id': user.id, 'year': year, 'leave_type': leave_type,
+              'days': days, 'enforce': int(enforce)}
+    if db.session.execute(db.text(RESERVE_LEAVE_DAYS_SQL), params).rowcount:
+        return True
+    # The UPDATE took the write lock, so opening the row can't race
+    if db.session.query(LeaveBalance.query.filter_by(
+            user_id=user.id, leave_year=year, leave_type=leave_type).exists()).scalar():
+        return False
+    open_leave_balance(user, leave_type, year)
+    return db.session.execute(db.text(RESERVE_LEAVE_DAYS_SQL), params).rowcount == 1
+
+
+def transfer_leave_days(leave, old_status, new_status):
+    """Move a leave's days between reserved and taken (or out) after a status change"""
+    old_column = LEAVE_BALANCE_COLUMNS.get(old_status)
+    new_column = LEAVE_BALANCE_COLUMNS.get(new_status)
+    if old_column == new_column or leave.leave_type not in LEAVE_TYPES:
+        return
+    # open_leave_balance() below counts from the leave rows, so write the new status first
+    db.session.flush()
+    year = leave.start_date.year
+    if not db.session.query(LeaveBalance.query.filter_by(
+            user_id=leave.user_id, leave_year=year, leave_type=leave.leave_type).exists()).scalar():
+        # Opened from the leave rows, which already reflect the new status
+        open_leave_balance(leave.applicant, leave.leave_type, year)
+        return
+    changes = []
+    if old_column:
+        changes.append(f'{old_column} = {old_column} - :days')
+    if new_column:
+        changes.append(f'{new_column} = {new_column} + :days')
+    db.session.execute(db.text(f"""
+        UPDATE leave_balance SET {', '.join(changes)}
+        WHERE user_id = :user_id AND leave_year = :year AND leave_type = :leave_type
+    """), {'days': leave.total_days, 'user_id': leave.user_id, 'year': year, 'leave_type': leave.leave_type})
+
+
+def sync_leave_balances():
+    """Recount taken and reserved days of every balance row from the leave table"""
+    updated = db.session.execute(db.text("""
+        UPDATE leave_balance SET
+            taken = COALESCE((SELECT SUM(total_days) FROM leave l
+                              WHERE l.user_id = leave_balance.user_id AND l.leave_type = leave_balance.leave_type
+                                AND l.status = 'Approved'
+                                AND l.start_date BETWEEN leave_year || '-01-01' AND leave_year || '-12-31'), 0),
+            reserved = COALESCE((SELECT SUM(total_days) FROM leave l
+                                 WHERE l.user_id = leave_balance.user_id AND l.leave_type = leave_balance.leave_type
+                                   AND l.status = 'Pending'
+                                   AND l.start_date BETWEEN leave_year || '-01-01' AND leave_year || '-12-31'), 0)
+    """)).rowcount
+    db.session.commit()
+    return updated
+
+
+@app.cli.command('sync-leave-balances')
+def sync_leave_balances_command():
+    """Recount approved and pending days held in every leave balance."""
+    started = time.perf_counter()
+    updated = sync_leave_balances()
+    print(f"✅ Recounted {updated} leave balances in {time.perf_counter() - started:.1f}s")
+
+
+def _prorated_sql(days, year):
+    """SQL twin of prorated_allowance() over user.date_of_joining.
+
+    SQLite's ROUND() rounds half away from zero; CAST(x + 0.5 AS INTEGER)
+    is the same half-up rounding as the Python side for these non-negative values.
+    """
+    joined_year = "CAST(strftime('%Y', u.date_of_joining) AS INTEGER)"
+    joined_month = "CAST(strftime('%m', u.date_of_joining) AS INTEGER)"
+    return (f"CASE WHEN {joined_year} < {year} THEN {days} "
+            f"WHEN {joined_year} > {year} THEN 0 "
+            f"ELSE CAST({days} * (13 - {joined_month}) / 12.0 * 2 + 0.5 AS INTEGER) / 2.0 END")
+
+
+def close_leave_year(year, chunk_size=2000, restart=False):
+    """Open leave year+1 for every active employee: accrual plus capped carry-forward.
+
+    One INSERT ... SELECT per chunk of user ids covers all leave types at once.
+    Rows already there (opened early by a leave application, or by an earlier
+    run) get their entitlement recomputed and keep their taken/reserved days,
+    so re-running the job is harmless. The last user id of each chunk is
+    committed with it in leave_year_closing; an interrupted run resumes after
+    it, a finished one (or restart=True) starts again from the first user.
+    """
+    policies = leave_policies()
+    policy_rows = ', '.join(f'(:type_{i}, :days_{i}, :cap_{i})' for i in range(len(policies)))
+    params = {'year': year, 'next_year': year + 1,
+              'year_start': date(year, 1, 1).isoformat(), 'year_end': date(year, 12, 31).isoformat(),
+              'next_year_start': date(year + 1, 1, 1).isoformat(),
+              'next_year_end': date(year + 1, 12, 31).isoformat(), 'now': datetime.utcnow()}
+    for i, (leave_type, (days, cap)) in enumerate(policies.items()):
+        params.update({f'type_{i}': leave_type, f'days_{i}': days, f'cap_{i}': cap})
+
+    statement = db.text(f"""
+        WITH policy(leave_type, days, cap) AS (VALUES {policy_rows}),
+        taken AS (
+            SELECT user_id, leave_type, SUM(total_days) AS days
+            FROM leave
+            WHERE status = 'Approved' AND start_date BETWEEN :year_start AND :year_end
+              AND user_id > :after AND user_id <= :upto
+            GROUP BY user_id, leave_type
+        ),
+        booked AS (
+            SELECT user_id, leave_type,
+                   SUM(CASE WHEN status = 'Approved' THEN total_days ELSE 0 END) AS taken,
+                   SUM(CASE WHEN status = 'Pending' THEN total_days ELSE 0 END) AS reserved
+            FROM leave
+            WHERE status IN ('Approved', 'Pending') AND start_date BETWEEN :next_year_start AND :next_year_end
+              AND user_id > :after AND user_id <= :upto
+            GROUP BY user_id, leave_type
+        )
+        INSERT INTO leave_balance (user_id, leave_year, leave_type, accrued, carried_forward,
+                                   taken, reserved, created_at)
+        SELECT u.id, :next_year, p.leave_type,
+               {_prorated_sql('p.days', ':next_year')},
+               MIN(p.cap, MAX(0, COALESCE(prev.accrued + prev.carried_forward,
+                                          {_prorated_sql('p.days', ':year')}) - COALESCE(t.days, 0))),
+               COALESCE(b.taken, 0), COALESCE(b.reserved, 0),
+               :now
+        FROM user u
+        CROSS JOIN policy p
+        LEFT JOIN leave_balance prev
+               ON prev.user_id = u.id AND prev.leave_year = :year AND prev.leave_type = p.leave_type
+        LEFT JOIN taken t ON t.user_id = u.id AND t.leave_type = p.leave_type
+        LEFT JOIN booked b ON b.user_id = u.id AND b.leave_type = p.leave_type
+        WHERE u.is_admin = 0 AND u.is_active = 1 AND u.date_of_joining <= :next_year_end
+          AND u.id > :after AND u.id <= :upto
+        ON CONFLICT (user_id, leave_year, leave_type) DO UPDATE SET
+            accrued = excluded.accrued,
+            carried_forward = excluded.carried_forward
+    """).bindparams(db.bindparam('now', type_=db.DateTime))
+
+    progress = db.session.get(LeaveYearClosing, year)
+    if progress is None:
+        progress = LeaveYearClosing(leave_year=year, last_user_id=0)
+        db.session.add(progress)
+    elif restart or progress.finished_at is not None:
+        progress.last_user_id, progress.started_at, progress.finished_at = 0, datetime.utcnow(), None
+    elif progress.last_user_id:
+        print(f"  {year + 1}: resuming after user {progress.last_user_id}")
+    db.session.commit()
+
+    created = 0
+    after = progress.last_user_id
+    while True:
+        upto = db.session.execute(db.text(
+            'SELECT MAX(id) FROM (SELECT id FROM user WHERE id > :after ORDER BY id LIMIT :limit)'
+        ), {'after': after, 'limit': chunk_size}).scalar()
+        if upto is None:
+            break
+
+        db.session.execute(statement, {**params, 'after': after, 'upto': upto})
+        # rowcount is -1 for statements starting with WITH
+        created += db.session.execute(db.text('SELECT changes()')).scalar()
+        progress.last_user_id = after = upto
+        db.session.commit()
+        print(f"  {year + 1}: opened balances up to user {upto} ({created} rows)")
+
+    progress.finished_at = datetime.utcnow()
+    db.session.commit()
+    return created
+
+
+@app.cli.command('close-leave-year')
+@click.option('--year', type=int, default=None, help='Leave year to close (default: last year).')
+@click.option('--chunk-size', default=2000, show_default=True, help='Employees per transaction.')
+@click.option('--restart', is_flag=True, help='Start from the first employee instead of resuming an interrupted run.')
+def close_leave_year_command(year, chunk_size, restart):
+    """Carry unused leave forward and open the next leave year for everyone."""
+    year = year or date.today().year - 1
+    started = time.perf_counter()
+    created = close_leave_year(year, chunk_size, restart)
+    print(f"✅ Opened leave year {year + 1}: {created} balances in {time.perf_counter() - started:.1f}s")
+
+
+# Notification outbox: rows are written in the same transaction as the leave
+# change and sent later by a dispatcher, so requests never wait on SMTP
+LEAVE_NOTIFICATION_SUBJECTS = {
+    'Pending': 'Leave application received',
+    'Approved': 'Leave application approved',
+    'Rejected': 'Leave application rejected'
+}
+# Claimed rows not finished within this long are picked up again
+NOTIFICATION_LEASE_SECONDS = 300
+
+_notification_stats = {'batches': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'send_seconds': 0.0}
+_notification_stats_lock = threading.Lock()
+_notification_wakeup = threading.Event()
+
+
+def queue_leave_notification(leave, user):
+    """Add an outbox row for a leave status change; the caller commits it"""
+    # Column defaults are only applied at flush
+    status = leave.status or 'Pending'
+    lines = [
+        f"Dear {user.get_full_name()},",
+        "",
+        f"Your {leave.leave_type} leave from {leave.start_date.strftime('%d %b %Y')} "
+        f"to {leave.end_date.strftime('%d %b %Y')} ({leave.total_days} days) "
+        + ("has been received and is awaiting approval." if status == 'Pending' else f"has been {status.lower()}."),
+    ]
+    if leave.admin_comment:
+        lines.append(f"Comment: {leave.admin_comment}")
+    lines += ["", "TextileLeave Pro"]
+
+    db.session.add(Notification(
+        user_id=user.id,
+        recipient=user.email,
+        subject=LEAVE_NOTIFICATION_SUBJECTS.get(status, 'Leave application updated'),
+        body='\n'.join(lines)
+    ))
+
+
+def wake_notification_dispatcher():
+    _notification_wakeup.set()
+
+
+class SMTPTransport:
+    """Sends a batch over one SMTP connection"""
+
+    def __init__(self, config):
+        self.config = config
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = smtplib.SMTP(self.config['MAIL_SERVER'], self.config['MAIL_PORT'], timeout=30)
+        if self.config['MAIL_USE_TLS']:
+            self.connection.starttls()
+        if self.config['MAIL_USERNAME']:
+            self.connection.login(self.config['MAIL_USERNAME'], self.config['MAIL_PASSWORD'])
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.connection.quit()
+        except smtplib.SMTPException:
+            self.connection.close()
+
+    def send(self, notification):
+        message = EmailMessage()
+        message['From'] = self.config['MAIL_DEFAULT_SENDER']
+        message['To'] = notification.recipient
+        message['Subject'] = notification.subject
+        message.set_content(notification.body)
+        self.connection.send_message(message)
+
+
+class ConsoleTransport:
+    """Prints messages instead of sending them (development)"""
+
+    def __init__(self, config):
+        self.config = config
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send(self, notification):
+        print(f"📧 To: {notification.recipient} | {notification.subject}\n{notification.body}")
+
+
+NOTIFICATION_TRANSPORTS = {
+    'smtp': SMTPTransport,
+    'console': ConsoleTransport
+}
+
+
+def claim_notifications(worker, limit):
+    """Lease due rows to this worker so parallel dispatchers never send twice"""
+    now = datetime.utcnow()
+    statement = db.text("""
+        UPDATE notification
+        SET status = 'Sending', claimed_by = :worker, next_attempt_at = :lease_until
+        WHERE id IN (
+            SELECT id FROM notification
+            WHERE status IN ('Pending', 'Sending') AND next_attempt_at <= :now
+            ORDER BY next_attempt_at
+            LIMIT :limit
+        )
+    """).bindparams(db.bindparam('now', type_=db.DateTime), db.bindparam('lease_until', type_=db.DateTime))
+    claimed = db.session.execute(statement, {
+        'worker': worker,
+        'now': now,
+        'lease_until': now + timedelta(seconds=NOTIFICATION_LEASE_SECONDS),
+        'limit': limit
+    })
+    db.session.commit()
+    if not claimed.rowcount:
+        return []
+    return Notification.query.filter_by(status='Sending', claimed_by=worker).order_by(Notification.id).all()
+
+
+def dispatch_notifications(transport=None, worker=None):
+    """Send one batch of due notifications; returns how many were sent"""
+    worker = worker or f'{os.getpid()}-{threading.get_ident()}'
+    batch = claim_notifications(worker, app.config['NOTIFICATION_BATCH_SIZE'])
+    if not batch:
+        return 0
+
+    transport = transport or NOTIFICATION_TRANSPORTS[app.config['NOTIFICATION_TRANSPORT']](app.config)
+    sent = retried = failed = 0
+    started = time.perf_counter()
+    try:
+        with transport:
+            for notification in batch:
+                try:
+                    transport.send(notification)
+                except (smtplib.SMTPException, OSError) as e:
+                    if isinstance(e, smtplib.SMTPServerDisconnected):
+                        raise
+                    if schedule_notification_retry(notification, e):
+                        retried += 1
+                    else:
+                        failed += 1
+                else:
+                    notification.status = 'Sent'
+                    notification.sent_at = datetime.utcnow()
+                    notification.attempts += 1
+                    notification.claimed_by = None
+                    sent += 1
+    except (smtplib.SMTPException, OSError) as e:
+        # Connection-level failure: everything not yet sent is retried later
+        for notification in batch:
+            if notification.status == 'Sending' and notification.claimed_by == worker:
+                if schedule_notification_retry(notification, e):
+                    retried += 1
+                else:
+                    failed += 1
+    db.session.commit()
+
+    with _notification_stats_lock:
+        _notification_stats['batches'] += 1
+        _notification_stats['sent'] += sent
+        _notification_stats['retried'] += retried
+        _notification_stats['failed'] += failed
+        _notification_stats['send_seconds'] += time.perf_counter() - started
+    return sent
+
+
+def schedule_notification_retry(notification, error):
+    """Exponential backoff; gives up after NOTIFICATION_MAX_ATTEMPTS. True if retried."""
+    notification.attempts += 1
+    notification.last_error = str(error)[:500]
+    notification.claimed_by = None
+    if notification.attempts >= app.config['NOTIFICATION_MAX_ATTEMPTS']:
+        notification.status = 'Failed'
+        return False
+    delay = app.config['NOTIFICATION_RETRY_BASE_SECONDS'] * 2 ** (notification.attempts - 1)
+    notification.status = 'Pending'
+    notification.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    return True
+
+
+def drain_notification_outboxes():
+    """Send everything due in every site's outbox; returns how many were sent"""
+    total = 0
+    for site in app.config['SITES']:
+        try:
+            with app.app_context():
+                g.site = site
+                while True:
+                    sent = dispatch_notifications()
+                    if not sent:
+                        break
+                    total += sent
+        except Exception as e:
+            print(f"❌ Notification dispatch failed for {site}: {e}")
+    return total
+
+
+def run_notification_dispatcher(stop_event=None):
+    """Dispatch loop: drains the outboxes, then sleeps until woken or the poll interval passes.
+
+    wake_notification_dispatcher() only reaches a dispatcher in the same
+    process; a separate `flask dispatch-notifications` worker picks new rows
+    up within NOTIFICATION_POLL_SECONDS.
+    """
+    while stop_event is None or not stop_event.is_set():
+        _notification_wakeup.clear()
+        drain_notification_outboxes()
+        _notification_wakeup.wait(app.config['NOTIFICATION_POLL_SECONDS'])
+
+
+def start_notification_dispatcher():
+    """In-process dispatcher thread, for the development server only"""
+    thread = threading.Thread(target=run_notification_dispatcher, name='notification-dispatcher', daemon=True)
+    thread.start()
+    return thread
+
+
+def notification_metrics():
+    queue = dict(db.session.query(Notification.status, db.func.count(Notification.id))
+                 .group_by(Notification.status).all())
+    oldest_pending = db.session.query(db.func.min(Notification.created_at)) \
+        .filter(Notification.status.in_(['Pending', 'Sending'])).scalar()
+    with _notification_stats_lock:
+        stats = dict(_notification_stats)
+    attempts = stats['sent'] + stats['retried'] + stats['failed']
+    return {
+        'queue': queue,
+        'oldest_pending_seconds': round((datetime.utcnow() - oldest_pending).total_seconds(), 1)
+        if oldest_pending else None,
+        'batches': stats['batches'],
+        'sent': stats['sent'],
+        'retried': stats['retried'],
+        'failed': stats['failed'],
+        'avg_send_ms': round(stats['send_seconds'] * 1000 / attempts, 2) if attempts else None
+    }
+
+
+@app.route('/admin/metrics/notifications')
+@login_required
+@admin_required
+def notification_metrics_view():
+    return jsonify(notification_metrics())
+
+
+@app.cli.command('dispatch-notifications')
+@click.option('--once', is_flag=True, help='Drain every outbox once and exit (for cron).')
+def dispatch_notifications_command(once):
+    """Send queued leave notifications for every site (runs until stopped unless --once).
+
+    This is the production entry point: run it as its own long-lived process
+    (systemd, supervisor, a container) next to the web workers, or from cron
+    with --once. Web workers never send mail themselves.
+    """
+    if once:
+        total = drain_notification_outboxes()
+        print(f"✅ Sent {total} notifications")
+        print(notification_metrics())
+    else:
+        print("📨 Notification dispatcher running...")
+        run_notification_dispatcher()
+
+
+# Attendance archival
+
+def attendance_archive_path(year):
+    site = current_site()
+    directory = app.config['ATTENDANCE_ARCHIVE_DIR']
+    if site != app.config['DEFAULT_SITE']:
+        directory = os.path.join(directory, site)
+    return os.path.join(directory, f'attendance_{year}.db')
+
+
+def is_archived_year(year):
+    """Whether a year has been (or is due to be) moved out of the live table"""
+    return year <= date.today().year - app.config['ATTENDANCE_HOT_YEARS']
+
+
+def attach_attendance_archive(conn, year):
+    """ATTACH a year's archive file on this connection if needed; return its schema name"""
+    schema = f'archive_{year}'
+    attached = {row[1] for row in conn.exec_driver_sql('PRAGMA database_list')}
+    if schema not in attached:
+        path = attendance_archive_path(year)
+        if not os.path.exists(path):
+            return None
+        conn.exec_driver_sql(f'ATTACH DATABASE ? AS {schema}', (path,))
+    return schema
+
+
+def attendance_history_view(years, conn=None):
+    """(Re)create a temp view unioning live attendance with the given archived years"""
+    conn = conn or db.session.connection()
+    columns = [column.name for column in Attendance.__table__.columns]
+
+    selects = [f"SELECT {', '.join(columns)} FROM main.attendance"]
+    for year in sorted(set(years)):
+        schema = attach_attendance_archive(conn, year)
+        if not schema:
+            continue
+        # Archives written by older versions may lack newer columns
+        archived = {row[1] for row in conn.exec_driver_sql(f'PRAGMA {schema}.table_info(attendance)')}
+        projection = ', '.join(name if name in archived else f'NULL AS {name}' for name in columns)
+        selects.append(f'SELECT {projection} FROM {schema}.attendance')
+
+    conn.exec_driver_sql('DROP VIEW IF EXISTS temp.attendance_history')
+    conn.exec_driver_sql('CREATE TEMP VIEW attendance_history AS ' + ' UNION ALL '.join(selects))
+    return 'attendance_history'
+
+
+def prepare_attendance_archive(conn, schema):
+    """Create the archive table in an attached schema, adding any columns it lacks"""
+    dialect = db.engine.dialect
+    column_defs = []
+    for column in Attendance.__table__.columns:
+        definition = f'{column.name} {column.type.compile(dialect=dialect)}'
+        if column.primary_key:
+            definition += ' PRIMARY KEY'
+        column_defs.append(definition)
+
+    conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {schema}.attendance ({', '.join(column_defs)})")
+    conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {schema}.ix_attendance_user_date ON attendance (user_id, date)')
+
+    existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA {schema}.table_info(attendance)')}
+    for column, definition in zip(Attendance.__table__.columns, column_defs):
+        if column.name not in existing:
+            conn.exec_driver_sql(f'ALTER TABLE {schema}.attendance ADD COLUMN {definition}')
+
+
+def archive_attendance_year(year, chunk_size=5000):
+    """Move one year's attendance rows into its archive file, one chunk per transaction.
+
+    Each chunk is copied and deleted in the same transaction, and rows are
+    copied with INSERT OR IGNORE, so an interrupted run can simply be restarted.
+    """
+    os.makedirs(os.path.dirname(attendance_archive_path(year)), exist_ok=True)
+    columns = ', '.join(column.name for column in Attendance.__table__.columns)
+    year_start = date(year, 1, 1).isoformat()
+    next_year_start = date(year + 1, 1, 1).isoformat()
+    moved = 0
+
+    with site_engine().connect() as conn:
+        schema = f'archive_{year}'
+        conn.exec_driver_sql(f'ATTACH DATABASE ? AS {schema}', (attendance_archive_path(year),))
+        try:
+            prepare_attendance_archive(conn, schema)
+            conn.commit()
+
+            while True:
+                ids = [row[0] for row in conn.exec_driver_sql(
+                    'SELECT id FROM main.attendance WHERE date >= ? AND date < ? ORDER BY id LIMIT ?',
+                    (year_start, next_year_start, chunk_size)
+                )]
+                if not ids:
+                    break
+
+                placeholders = ', '.join('?' * len(ids))
+                conn.exec_driver_sql(
+                    f'INSERT OR IGNORE INTO {schema}.attendance ({columns}) '
+                    f'SELECT {columns} FROM main.attendance WHERE id IN ({placeholders})',
+                    tuple(ids)
+                )
+                conn.exec_driver_sql(f'DELETE FROM main.attendance WHERE id IN ({placeholders})', tuple(ids))
+                conn.commit()
+
+                moved += len(ids)
+                print(f"  {year}: moved {moved} rows")
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql(f'DETACH DATABASE {schema}')
+
+    return moved
+
+
+@app.cli.command('archive-attendance')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows moved per transaction.')
+@click.option('--year', type=int, default=None, help='Archive a single closed year only.')
+def archive_attendance_command(chunk_size, year):
+    """Move attendance for closed years into per-year archive databases."""
+    if year is not None:
+        if not is_archived_year(year):
+            raise click.BadParameter(f'{year} is still a live year', param_hint='--year')
+        years = [year]
+    else:
+        years = [int(found) for found in db.session.execute(db.text(
+            "SELECT DISTINCT strftime('%Y', date) FROM attendance"
+        )).scalars() if found and is_archived_year(int(found))]
+        db.session.rollback()
+
+    if not years:
+        print("✅ Nothing to archive")
+        return
+
+    for archive_year in sorted(years):
+        print(f"📦 Archiving attendance for {archive_year} -> {attendance_archive_path(archive_year)}")
+        moved = archive_attendance_year(archive_year, chunk_size=chunk_size)
+        print(f"✅ {archive_year}: {moved} rows archived")
+
+
 # Initialize database
 def init_db():
     with app.app_context():
+        try:
+            build_assets()
+            print("✅ Static assets built!")
+        except Exception as e:
+            print(f"❌ Static asset build failed: {e}")
+
+    for site in app.config['SITES']:
+        init_site_db(site)
+
+
+def init_site_db(site):
+    with app.app_context():
+        g.site = site
         try:
             # Create tables
-            db.create_all()
-            print("✅ Database tables created successfully!")
+            # Reporting binds are read-only copies, never created here
+            db.metadata.create_all(bind=site_engine())
+            print(f"✅ Database tables created successfully for site {site}!")
+
+            changes = upgrade_schema()
+            for change in changes:
+                print(f"✅ Added {change}")
+            if 'column leave_balance.reserved' in changes:
+                print(f"✅ Leave balances now hold pending days ({sync_leave_balances()} recounted)")
+
+            stamped = ensure_change_tracking()
+            print(f"✅ Change tracking ready ({stamped} existing rows stamped)")
+
+            if ensure_shift_roster():
+                print("✅ Default shift roster created!")
+
+            if not AttendanceBitmap.query.first() and Attendance.query.first():
+                years = rebuild_attendance_bitmaps()
+                print(f"✅ Attendance bitmaps built for {', '.join(map(str, years))}")
+
+            if ensure_search_index():
+                print("✅ Full-text search index ready!")
 
             # Check if admin exists
             admin_email = 'admin@textile.com'
@@ -1413,4 +5196,9 @@ if __name__ == '__main__':
     print(f"🏠 Running on: http://127.0.0.1:5000")
 
     init_db()
+    # Development convenience only: the debug reloader runs the app in a child
+    # process, so dispatch there. Production servers (gunicorn etc.) never run
+    # this block; they need `flask --app app dispatch-notifications` running.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_notification_dispatcher()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""Benchmark the paged leave PDF export.
+
+Builds leave PDFs from synthetic rows and reports build time, output size
+and peak RSS for each size. Every measurement runs in a fresh process so
+peak RSS is not inflated by earlier runs.
+
+Usage:
+    python benchmarks/bench_pdf_export.py                 # 1k, 10k, 100k rows
+    python benchmarks/bench_pdf_export.py --sizes 1000 5000
+    python benchmarks/bench_pdf_export.py --legacy        # also time the old single-table layout
+
+Peak RSS uses the resource module, so this runs on Linux/macOS only.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+DEFAULT_SIZES = [1000, 10000, 100000]
+# The old layout lays out one huge table; past this it takes far too long
+LEGACY_MAX_ROWS = 10000
+
+
+def synthetic_rows(count):
+    departments = ['Weaving', 'Spinning', 'Dyeing', 'Finishing', 'Quality Control']
+    leave_types = ['Annual', 'Sick', 'Casual', 'Emergency']
+    statuses = ['Pending', 'Approved', 'Rejected']
+    start = date(2024, 1, 1)
+    for i in range(count):
+        day = start + timedelta(days=i % 365)
+        yield [
+            f"Worker{i} Surname{i % 997}",
+            departments[i % len(departments)],
+            leave_types[i % len(leave_types)],
+            day.strftime('%Y-%m-%d'),
+            (day + timedelta(days=i % 5)).strftime('%Y-%m-%d'),
+            str(i % 5 + 1),
+            statuses[i % len(statuses)]
+        ]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def build_legacy(rows, output):
+    """The previous export: every row in one platypus Table"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+    from reportlab.lib import colors
+    from app import LEAVE_PDF_HEADER, LEAVE_PDF_COL_WIDTHS
+
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    table = Table([LEAVE_PDF_HEADER] + list(rows), colWidths=LEAVE_PDF_COL_WIDTHS)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    doc.build([table])
+
+
+def run_one(rows, mode):
+    """Measure a single build in this process and print the result as JSON"""
+    sys.path.insert(0, APP_DIR)
+    # Importing the app prints its configuration; keep the output clean
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        from app import app, build_leaves_pdf
+    finally:
+        sys.stdout = stdout
+
+    output = io.BytesIO()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    if mode == 'legacy':
+        build_legacy(synthetic_rows(rows), output)
+        pages = None
+    else:
+        pages = build_leaves_pdf(synthetic_rows(rows), output, total_rows=rows, max_rows=rows)
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'mode': mode,
+        'rows': rows,
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'size_kb': round(len(output.getvalue()) / 1024, 1),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--legacy', action='store_true',
+                        help=f'also benchmark the old single-table layout (up to {LEGACY_MAX_ROWS:,} rows)')
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', default='paged', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        run_one(args.run_one, args.mode)
+        return
+
+    modes = ['paged'] + (['legacy'] if args.legacy else [])
+    print(f"{'mode':<8} {'rows':>8} {'pages':>6} {'seconds':>9} {'size KB':>9} {'peak RSS MB':>12} {'+RSS MB':>8}")
+    for rows in args.sizes:
+        for mode in modes:
+            if mode == 'legacy' and rows > LEGACY_MAX_ROWS:
+                continue
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-one', str(rows), '--mode', mode],
+                capture_output=True, text=True, check=True
+            )
+            data = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{data['mode']:<8} {data['rows']:>8,} {data['pages'] or '-':>6} {data['seconds']:>9.2f} "
+                  f"{data['size_kb']:>9,.0f} {data['peak_rss_mb']:>12.1f} "
+                  f"{data['peak_rss_mb'] - data['baseline_rss_mb']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
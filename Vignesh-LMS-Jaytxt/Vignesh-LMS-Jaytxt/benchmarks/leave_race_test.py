@@ -0,0 +1,235 @@
+"""Concurrency test for leave balance reservations and approvals.
+
+Copies the app into a scratch directory, gives the sample employee a known
+Annual balance and fires concurrent applications for the same leave at
+/apply_leave, from threads in one process and from separate processes.
+Then fires conflicting approve/reject actions for the accepted leaves at
+/admin/leave/action. Checks that:
+
+  * exactly as many applications are accepted as the balance covers, the
+    balance never goes negative and every accepted leave holds its days;
+  * after the approval storm every leave is Approved or Rejected and the
+    balance row's taken/reserved days match a recount of the leave table.
+
+Exits non-zero if any check fails. The committed databases are never touched.
+
+Usage:
+    python benchmarks/leave_race_test.py                          # 24 threads, then 24 processes
+    python benchmarks/leave_race_test.py --mode processes --clients 48 --balance 20
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+EMPLOYEE_LOGIN = ('employee@textile.com', 'employee123')
+ADMIN_LOGIN = ('admin@textile.com', 'admin123')
+LEAVE_TYPE = 'Annual'
+REASON = 'Race test'
+
+
+def prepare_workdir():
+    workdir = tempfile.mkdtemp(prefix='lms-race-')
+    app_copy = os.path.join(workdir, 'app')
+    shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns(
+        '*.db', 'cache', 'archive', 'dist', 'uploads', '__pycache__', 'benchmarks', 'instance'))
+    return workdir, app_copy
+
+
+def load_app(app_copy):
+    """Import the app from the scratch copy, keeping its startup output quiet"""
+    if app_copy not in sys.path:
+        sys.path.insert(0, app_copy)
+        os.chdir(app_copy)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    return app
+
+
+def leave_dates():
+    """Monday to Wednesday (3 working days) of a week late in the current year"""
+    start = date(date.today().year, 12, 1)
+    start += timedelta(days=-start.weekday() % 7)
+    return start, start + timedelta(days=2)
+
+
+def reset_balance(app_copy, balance):
+    """Drop earlier race leaves and give the employee exactly `balance` Annual days"""
+    lms = load_app(app_copy)
+    with lms.app.app_context():
+        employee = lms.User.query.filter_by(email=EMPLOYEE_LOGIN[0]).one()
+        year = leave_dates()[0].year
+        lms.db.session.execute(lms.db.text('DELETE FROM leave WHERE reason = :reason'), {'reason': REASON})
+        lms.open_leave_balance(employee, LEAVE_TYPE, year)
+        lms.db.session.commit()
+        lms.sync_leave_balances()
+        available = lms.leave_balances(employee, year)[LEAVE_TYPE]
+        row = lms.LeaveBalance.query.filter_by(user_id=employee.id, leave_year=year, leave_type=LEAVE_TYPE).one()
+        row.accrued += balance - available
+        lms.db.session.commit()
+        return employee.id
+
+
+def logged_in_client(lms, login):
+    client = lms.app.test_client()
+    response = client.post('/login', data={'email': login[0], 'password': login[1]})
+    if response.status_code != 302:
+        raise RuntimeError(f'login as {login[0]} failed ({response.status_code})')
+    return client
+
+
+def apply(app_copy, barrier, results):
+    """One client: log in, wait for the others, then submit the same application"""
+    lms = load_app(app_copy)
+    client = logged_in_client(lms, EMPLOYEE_LOGIN)
+    start, end = leave_dates()
+    barrier.wait()
+    started = time.perf_counter()
+    response = client.post('/apply_leave', data={
+        'leave_type': LEAVE_TYPE, 'start_date': start.isoformat(), 'end_date': end.isoformat(), 'reason': REASON
+    })
+    results.append((response.status_code, response.headers.get('Location', ''), time.perf_counter() - started))
+
+
+def act(app_copy, barrier, results, leave_id, action):
+    """One admin: log in, wait for the others, then approve or reject a leave"""
+    lms = load_app(app_copy)
+    client = logged_in_client(lms, ADMIN_LOGIN)
+    barrier.wait()
+    started = time.perf_counter()
+    response = client.post(f'/admin/leave/action/{leave_id}', data={'action': action, 'comment': REASON})
+    results.append((response.status_code, response.headers.get('Location', ''), time.perf_counter() - started))
+
+
+def run_clients(mode, target, argument_lists):
+    """Run target once per argument tuple concurrently; returns the results they appended"""
+    if mode == 'threads':
+        barrier = threading.Barrier(len(argument_lists))
+        results = []
+        workers = [threading.Thread(target=target, args=(arguments[0], barrier, results) + arguments[1:])
+                   for arguments in argument_lists]
+    else:
+        # Fresh interpreters: no database connections or locks inherited from this process
+        context = multiprocessing.get_context('spawn')
+        manager = context.Manager()
+        barrier = manager.Barrier(len(argument_lists))
+        results = manager.list()
+        workers = [context.Process(target=target, args=(arguments[0], barrier, results) + arguments[1:])
+                   for arguments in argument_lists]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return list(results)
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, label, condition, detail=''):
+        print(f"  {'ok  ' if condition else 'FAIL'} {label}" + (f' ({detail})' if detail else ''))
+        if not condition:
+            self.failures += 1
+
+
+def latency_summary(results):
+    latencies = sorted(seconds for _, _, seconds in results)
+    if not latencies:
+        return 'no requests'
+    return f'p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms'
+
+
+def balance_state(lms, employee_id, year):
+    lms.db.session.expire_all()
+    row = lms.LeaveBalance.query.filter_by(user_id=employee_id, leave_year=year, leave_type=LEAVE_TYPE).one()
+    counted = dict(lms.db.session.execute(lms.db.text("""
+        SELECT status, COALESCE(SUM(total_days), 0) FROM leave
+        WHERE user_id = :user_id AND leave_type = :leave_type AND status IN ('Approved', 'Pending')
+          AND start_date BETWEEN :year_start AND :year_end
+        GROUP BY status
+    """), {'user_id': employee_id, 'leave_type': LEAVE_TYPE,
+           'year_start': date(year, 1, 1).isoformat(), 'year_end': date(year, 12, 31).isoformat()}).all())
+    return row, counted
+
+
+def run_mode(app_copy, mode, clients, balance):
+    print(f"\n{mode}: {clients} concurrent clients, balance {balance} days")
+    checks = Checks()
+    employee_id = reset_balance(app_copy, balance)
+    lms = load_app(app_copy)
+    start, end = leave_dates()
+    days = 3
+
+    results = run_clients(mode, apply, [(app_copy,)] * clients)
+    accepted = sum('leave_status' in location for _, location, _ in results)
+    expected = min(clients, balance // days)
+    with lms.app.app_context():
+        employee = lms.db.session.get(lms.User, employee_id)
+        row, counted = balance_state(lms, employee_id, start.year)
+        leave_ids = [leave_id for (leave_id,) in lms.db.session.query(lms.Leave.id).filter_by(
+            user_id=employee_id, reason=REASON).order_by(lms.Leave.id)]
+        available = lms.leave_balances(employee, start.year)[LEAVE_TYPE]
+    print(f"  applications: {latency_summary(results)}")
+    checks.expect('no server errors', all(status < 500 for status, _, _ in results))
+    checks.expect('accepted exactly what the balance covers', accepted == expected, f'{accepted} of {clients}, expected {expected}')
+    checks.expect('one leave row per accepted application', len(leave_ids) == accepted, f'{len(leave_ids)} rows')
+    checks.expect('reserved days match pending leaves',
+                  row.reserved == counted.get('Pending', 0) == accepted * days, f'reserved {row.reserved}')
+    checks.expect('balance never negative', available >= 0, f'{available} days left')
+
+    # Two or three conflicting actions per leave
+    actions = [(app_copy, leave_ids[i % len(leave_ids)], 'approve' if (i // len(leave_ids)) % 2 == 0 else 'reject')
+               for i in range(clients)] if leave_ids else []
+    results = run_clients(mode, act, actions) if actions else []
+    with lms.app.app_context():
+        row, counted = balance_state(lms, employee_id, start.year)
+        statuses = [status for (status,) in lms.db.session.query(lms.Leave.status).filter(lms.Leave.id.in_(leave_ids))]
+    print(f"  approvals: {latency_summary(results)}")
+    checks.expect('no server errors', all(status < 500 for status, _, _ in results))
+    checks.expect('every leave decided', all(status in ('Approved', 'Rejected') for status in statuses),
+                  ', '.join(sorted(set(statuses))))
+    checks.expect('taken and reserved match a recount',
+                  row.taken == counted.get('Approved', 0) and row.reserved == counted.get('Pending', 0),
+                  f'taken {row.taken}/{counted.get("Approved", 0)}, reserved {row.reserved}/{counted.get("Pending", 0)}')
+    return checks.failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['threads', 'processes', 'both'], default='both',
+                        help='where the concurrent clients run (default: both)')
+    parser.add_argument('--clients', type=int, default=24, help='concurrent clients (default: 24)')
+    parser.add_argument('--balance', type=int, default=30, help='Annual days available to the employee (default: 30)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+
+    workdir, app_copy = prepare_workdir()
+    failures = 0
+    try:
+        lms = load_app(app_copy)
+        with contextlib.redirect_stdout(io.StringIO()):
+            lms.init_db()
+        modes = ['threads', 'processes'] if args.mode == 'both' else [args.mode]
+        for mode in modes:
+            failures += run_mode(app_copy, mode, args.clients, args.balance)
+    finally:
+        if args.keep:
+            print(f"\nScratch copy kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'All checks passed' if not failures else f'{failures} check(s) failed'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
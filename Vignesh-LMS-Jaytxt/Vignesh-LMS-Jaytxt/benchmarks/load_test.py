@@ -0,0 +1,469 @@
+"""Concurrent load test for the main workflows.
+
+Copies the app into a scratch directory, seeds its database, serves it with
+N worker processes and drives one of the scenarios below with concurrent
+virtual users. Reports throughput, p50/p95/p99 latency and error rate per
+endpoint. The committed databases, caches and archives are never touched.
+
+Usage:
+    python benchmarks/load_test.py                            # every scenario
+    python benchmarks/load_test.py login-storm --users 50 --workers 4
+    python benchmarks/load_test.py workday --duration 60 --json results/workday.json
+    python benchmarks/load_test.py workday --compare results/workday.json
+
+Scenarios live in SCENARIOS so results stay comparable across releases;
+save them with --json and diff a later run against the file with --compare.
+The app is served by gunicorn when it is installed, otherwise by --workers
+pre-forked Werkzeug servers sharing one listening socket. Either way each
+worker handles one request at a time and keeps its in-process caches.
+Pre-forking uses os.fork, so this runs on Linux/macOS only.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PASSWORD = 'loadtest123'
+ADMIN_LOGIN = ('admin@textile.com', 'admin123')
+DEPARTMENTS = ['Weaving', 'Spinning', 'Dyeing', 'Finishing', 'Quality Control']
+SHIFTS = ['Morning', 'Evening', 'Night']
+
+
+# Seeding (runs in a subprocess inside the scratch copy)
+
+def seed(workdir, employees, leaves, attendance_days):
+    sys.path.insert(0, workdir)
+    os.chdir(workdir)
+    from app import app, db, init_db, rebuild_attendance_bitmaps, User, Leave, Attendance
+    from werkzeug.security import generate_password_hash
+
+    init_db()
+    rng = random.Random(42)
+    with app.app_context():
+        # Hashing is deliberately slow; every seeded employee shares one hash
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.bulk_insert_mappings(User, [{
+            'employee_id': f'LT{i:05d}',
+            'first_name': f'Worker{i}',
+            'last_name': f'Load{i % 97}',
+            'email': f'worker{i}@load.test',
+            'department': DEPARTMENTS[i % len(DEPARTMENTS)],
+            'designation': 'Operator',
+            'shift': SHIFTS[i % len(SHIFTS)],
+            'date_of_joining': date(2020, 1, 1),
+            'password_hash': password_hash,
+            'is_admin': False,
+            'is_active': True,
+            'row_version': 1
+        } for i in range(employees)])
+        db.session.commit()
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.email.like('%@load.test'))]
+
+        statuses = ['Approved', 'Rejected', 'Pending']
+        db.session.bulk_insert_mappings(Leave, [{
+            'user_id': rng.choice(user_ids),
+            'leave_type': rng.choice(['Annual', 'Sick', 'Casual']),
+            'start_date': start,
+            'end_date': start + timedelta(days=2),
+            'total_days': 3,
+            'reason': f'Load test leave {i}',
+            'status': statuses[i % len(statuses)]
+        } for i, start in enumerate(date.today() - timedelta(days=rng.randint(-60, 300)) for _ in range(leaves))])
+
+        today = date.today()
+        for offset in range(attendance_days):
+            day = today - timedelta(days=offset + 1)
+            if day.weekday() >= 5:
+                continue
+            db.session.bulk_insert_mappings(Attendance, [{
+                'user_id': user_id,
+                'date': day,
+                'status': rng.choice(['Present', 'Present', 'Present', 'Late', 'Absent']),
+                'worked_hours': 8,
+                'overtime_hours': 0
+            } for user_id in user_ids])
+        db.session.commit()
+        rebuild_attendance_bitmaps()
+
+        pending = [leave_id for (leave_id,) in db.session.query(Leave.id).filter_by(status='Pending')]
+    print(json.dumps({'employees': len(user_ids), 'pending_leave_ids': pending}))
+
+
+def prepare_workdir(args):
+    workdir = tempfile.mkdtemp(prefix='lms-load-')
+    app_copy = os.path.join(workdir, 'app')
+    shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns(
+        '*.db', 'cache', 'archive', 'dist', 'uploads', '__pycache__', 'benchmarks', 'instance'))
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--seed', app_copy,
+         '--employees', str(args.employees), '--leaves', str(args.leaves),
+         '--attendance-days', str(args.attendance_days)],
+        capture_output=True, text=True, check=True
+    )
+    return workdir, app_copy, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Serving
+
+def serve(app_dir, port, workers):
+    """Pre-fork Werkzeug workers that accept from one shared socket"""
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+    from app import app
+    from werkzeug.serving import make_server
+
+    listener = socket.create_server(('127.0.0.1', port), backlog=1024)
+    for _ in range(workers):
+        if os.fork() == 0:
+            make_server('127.0.0.1', port, app, fd=listener.fileno()).serve_forever()
+            os._exit(0)
+    signal.signal(signal.SIGTERM, lambda *_: os.killpg(0, signal.SIGKILL))
+    os.wait()
+
+
+def start_server(app_dir, workers):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    env = dict(os.environ, NOTIFICATION_TRANSPORT='console', LMS_SITES='main=textile_lms.db')
+    env.pop('LMS_SITE', None)
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, '-m', 'gunicorn', '--chdir', app_dir, '-w', str(workers),
+                   '-b', f'127.0.0.1:{port}', 'app:app']
+        server = 'gunicorn'
+    except ImportError:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', app_dir,
+                   '--port', str(port), '--workers', str(workers)]
+        server = 'werkzeug'
+    process = subprocess.Popen(command, cwd=app_dir, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/login')
+            if conn.getresponse().status == 200:
+                return process, port, server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError('App server did not start within 30s')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    process.wait()
+
+
+# Virtual users
+
+class Session:
+    """One browser: a cookie jar, who is logged in, and the run's latency log"""
+
+    def __init__(self, port, results):
+        self.port = port
+        self.results = results
+        self.cookies = {}
+        self.role = None
+
+    def request(self, endpoint, method, path, form=None, expect=None):
+        """Send one request; record latency and whether it met expectations"""
+        headers = {'Accept-Encoding': 'gzip, br'}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        started = time.perf_counter()
+        error = None
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            for header in response.headers.get_all('Set-Cookie') or []:
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value
+            location = response.getheader('Location') or ''
+            if response.status >= 400:
+                error = f'HTTP {response.status}'
+            elif expect and expect not in location:
+                error = f'redirected to {location or "nowhere"}'
+        except OSError as e:
+            error = type(e).__name__
+        self.results.record(endpoint, time.perf_counter() - started, error)
+        return error is None
+
+    def login(self, email, password=PASSWORD, role='employee'):
+        self.cookies.clear()
+        self.role = None
+        if self.request('POST /login', 'POST', '/login',
+                        {'email': email, 'password': password}, expect='/dashboard'):
+            self.role = role
+        return self.role is not None
+
+    def ensure_employee(self, context):
+        return self.role == 'employee' or self.login(f'worker{random.randrange(context["employees"])}@load.test')
+
+    def ensure_admin(self):
+        return self.role == 'admin' or self.login(*ADMIN_LOGIN, role='admin')
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, error):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((seconds, error is None))
+            if error:
+                key = (endpoint, error)
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+
+# Actions: one user-visible step, possibly several requests
+
+def morning_login(session, context):
+    email = f'worker{next(context["employee_numbers"]) % context["employees"]}@load.test'
+    if session.login(email):
+        session.request('GET /user/dashboard', 'GET', '/user/dashboard')
+
+
+def submit_leave(session, context):
+    if not session.ensure_employee(context):
+        return
+    start = date.today() + timedelta(days=random.randint(7, 300))
+    session.request('POST /apply_leave', 'POST', '/apply_leave', {
+        'leave_type': 'Casual',
+        'start_date': start.isoformat(),
+        'end_date': (start + timedelta(days=random.randint(0, 2))).isoformat(),
+        'reason': 'Family function (load test)'
+    }, expect='/user/leave_status')
+
+
+def approve_leave(session, context):
+    if not session.ensure_admin():
+        return
+    with context['lock']:
+        leave_id = next(context['pending_leave_ids'])
+    session.request('POST /admin/leave/action', 'POST', f'/admin/leave/action/{leave_id}',
+                    {'action': random.choice(['approve', 'approve', 'reject']), 'comment': 'load test'},
+                    expect='/admin/leaves')
+
+
+def view_reports(session, context):
+    if not session.ensure_admin():
+        return
+    session.request('GET /admin/reports', 'GET', '/admin/reports')
+
+
+def export_leaves(session, context):
+    if not session.ensure_admin():
+        return
+    session.request('POST /admin/leaves/export', 'POST', '/admin/leaves/export', {'format': 'csv'})
+
+
+def export_report(session, context):
+    if not session.ensure_admin():
+        return
+    session.request('POST /admin/reports (excel)', 'POST', '/admin/reports', {'format': 'excel'})
+
+
+# Scenarios: groups of virtual users, each a share of --users with a weighted
+# action mix. A virtual user keeps its group and session for the whole run.
+SCENARIOS = {
+    'login-storm': {
+        'description': 'Shift start: everyone logs in and opens their dashboard',
+        'groups': [(1.0, [(1, morning_login)])]
+    },
+    'workday': {
+        'description': 'Employees applying for leave while admins approve and check reports',
+        'groups': [
+            (0.8, [(1, submit_leave)]),
+            (0.2, [(70, approve_leave), (20, view_reports), (10, export_leaves)])
+        ]
+    },
+    'month-end': {
+        'description': 'Admins pulling reports and exports while leave keeps coming in',
+        'groups': [
+            (0.5, [(1, submit_leave)]),
+            (0.5, [(20, approve_leave), (30, view_reports), (30, export_leaves), (20, export_report)])
+        ]
+    }
+}
+
+
+def group_mix(groups, number, users):
+    """The action mix of the group virtual user `number` belongs to"""
+    position = (number + 0.5) / users
+    cumulative = 0
+    for share, mix in groups:
+        cumulative += share
+        if position <= cumulative:
+            return mix
+    return groups[-1][1]
+
+
+def run_scenario(name, port, seeded, users, duration):
+    scenario = SCENARIOS[name]
+    results = Results()
+    context = {
+        'employees': seeded['employees'],
+        'employee_numbers': itertools.count(),
+        'pending_leave_ids': itertools.cycle(seeded['pending_leave_ids'] or [1]),
+        'lock': threading.Lock()
+    }
+    deadline = time.monotonic() + duration
+
+    def virtual_user(number):
+        session = Session(port, results)
+        rng = random.Random(number)
+        weights, actions = zip(*group_mix(scenario['groups'], number, users))
+        while time.monotonic() < deadline:
+            rng.choices(actions, weights)[0](session, context)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+# Reporting
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    summary = {}
+    for endpoint, samples in sorted(results.samples.items()):
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        summary[endpoint] = {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4),
+            'rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(latencies[-1], 1)
+        }
+    return summary
+
+
+def print_summary(name, run, baseline=None):
+    print(f"\n{name}: {SCENARIOS[name]['description']}")
+    print(f"  {run['users']} users, {run['workers']} {run['server']} workers, {run['seconds']:.0f}s, "
+          f"{run['employees']:,} employees seeded")
+    print(f"  {'endpoint':<30} {'reqs':>7} {'req/s':>8} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}" + (f" {'p95 vs base':>12}" if baseline else ''))
+    for endpoint, stats in run['endpoints'].items():
+        line = (f"  {endpoint:<30} {stats['requests']:>7,} {stats['rps']:>8.1f} {stats['error_rate'] * 100:>6.1f} "
+                f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+        base = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if base:
+            change = (stats['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0
+            line += f" {change:>+11.0f}%"
+        print(line)
+    for error, count in sorted(run['errors'].items()):
+        print(f"  ! {error} x{count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f"one or more of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users (default: 20)')
+    parser.add_argument('--workers', type=int, default=4, help='app server worker processes (default: 4)')
+    parser.add_argument('--duration', type=int, default=30, help='seconds per scenario (default: 30)')
+    parser.add_argument('--employees', type=int, default=2000, help='employees to seed (default: 2000)')
+    parser.add_argument('--leaves', type=int, default=10000, help='leave applications to seed (default: 10000)')
+    parser.add_argument('--attendance-days', type=int, default=60,
+                        help='days of attendance to seed (default: 60)')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to compare p95 against')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--seed', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {', '.join(unknown)}; choose from {', '.join(SCENARIOS)}")
+
+    if args.seed:
+        # Importing the app prints its configuration; the caller reads the last line
+        seed(args.seed, args.employees, args.leaves, args.attendance_days)
+        return
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"Seeding {args.employees:,} employees, {args.leaves:,} leaves, {args.attendance_days} days of attendance...")
+    workdir, app_copy, seeded = prepare_workdir(args)
+    runs = {}
+    try:
+        # A fresh server per scenario so one scenario's writes and caches don't skew the next
+        for name in args.scenarios or list(SCENARIOS):
+            process, port, server = start_server(app_copy, args.workers)
+            try:
+                results, elapsed = run_scenario(name, port, seeded, args.users, args.duration)
+            finally:
+                stop_server(process)
+            runs[name] = {
+                'users': args.users,
+                'workers': args.workers,
+                'server': server,
+                'seconds': round(elapsed, 1),
+                'employees': seeded['employees'],
+                'endpoints': summarize(results, elapsed),
+                'errors': {f'{endpoint}: {error}': count for (endpoint, error), count in results.errors.items()}
+            }
+            print_summary(name, runs[name], baseline.get(name))
+    finally:
+        if args.keep:
+            print(f"\nScratch copy kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w') as f:
+            json.dump(runs, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
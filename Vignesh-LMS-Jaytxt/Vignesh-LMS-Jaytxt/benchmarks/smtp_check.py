@@ -0,0 +1,185 @@
+"""Check the SMTP notification transport against a local aiosmtpd server.
+
+Copies the app into a scratch directory, queues leave notifications in its
+outbox and drains them with the real SMTPTransport into an aiosmtpd server
+on a free local port. Checks that:
+
+  * every queued message arrives once, with the right From/To/Subject/body,
+    and its outbox row is marked Sent;
+  * a recipient the server refuses is retried later while the rest of the
+    batch is still delivered over the same connection;
+  * when the server is down every row is scheduled for retry, none is lost.
+
+Exits non-zero if any check fails. The committed databases are never touched.
+
+Usage:
+    python benchmarks/smtp_check.py
+    python benchmarks/smtp_check.py --messages 200 --keep
+
+Needs aiosmtpd (pip install aiosmtpd).
+"""
+import argparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+from email import message_from_bytes
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+REFUSED_RECIPIENT = 'refused@smtp.test'
+
+
+class RecordingHandler:
+    """aiosmtpd handler that keeps every message and refuses one mailbox"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED_RECIPIENT:
+            return '550 5.1.1 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, message_from_bytes(envelope.content)))
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_workdir():
+    workdir = tempfile.mkdtemp(prefix='lms-smtp-')
+    app_copy = os.path.join(workdir, 'app')
+    shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns(
+        '*.db', 'cache', 'archive', 'dist', 'uploads', '__pycache__', 'benchmarks', 'instance'))
+    return workdir, app_copy
+
+
+class Checks:
+    def __init__(self):
+        self.failures = 0
+
+    def expect(self, label, condition, detail=''):
+        print(f"  {'ok  ' if condition else 'FAIL'} {label}" + (f' ({detail})' if detail and not condition else ''))
+        if not condition:
+            self.failures += 1
+
+
+def queue(db, Notification, recipients):
+    rows = [Notification(user_id=1, recipient=recipient, subject=f'Leave application approved #{i}',
+                         body=f'Dear employee,\n\nLeave {i} has been approved.\n\nTextileLeave Pro')
+            for i, recipient in enumerate(recipients)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return [row.id for row in rows]
+
+
+def statuses(db, Notification, ids):
+    db.session.expire_all()
+    return {row.id: row for row in Notification.query.filter(Notification.id.in_(ids))}
+
+
+def run_checks(app_copy, messages):
+    from aiosmtpd.controller import Controller
+
+    port = free_port()
+    os.environ.update({'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(port), 'MAIL_USE_TLS': '0',
+                       'NOTIFICATION_TRANSPORT': 'smtp'})
+    os.environ.pop('MAIL_USERNAME', None)
+    sys.path.insert(0, app_copy)
+    os.chdir(app_copy)
+    from app import app, db, init_db, dispatch_notifications, Notification
+
+    init_db()
+    app.config['NOTIFICATION_BATCH_SIZE'] = max(10, messages // 3)
+    checks = Checks()
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        with app.app_context():
+            print(f"Delivery ({messages} messages, batches of {app.config['NOTIFICATION_BATCH_SIZE']})")
+            recipients = [f'worker{i}@smtp.test' for i in range(messages)]
+            ids = queue(db, Notification, recipients)
+            sent = 0
+            while True:
+                batch = dispatch_notifications()
+                if not batch:
+                    break
+                sent += batch
+            rows = statuses(db, Notification, ids)
+            checks.expect('dispatcher reports every message sent', sent == messages, f'{sent} sent')
+            checks.expect('server received every message once', len(handler.messages) == messages,
+                          f'{len(handler.messages)} received')
+            received = {tos[0]: message for tos, message in handler.messages}
+            checks.expect('each recipient got its own message', sorted(received) == sorted(recipients))
+            first = received.get(recipients[0])
+            checks.expect('headers and body carried over',
+                          first is not None
+                          and first['From'] == app.config['MAIL_DEFAULT_SENDER']
+                          and first['Subject'] == 'Leave application approved #0'
+                          and 'Leave 0 has been approved.' in first.get_payload(decode=True).decode())
+            checks.expect('outbox rows marked Sent',
+                          all(row.status == 'Sent' and row.sent_at and row.claimed_by is None
+                              for row in rows.values()))
+
+            print("Refused recipient")
+            handler.messages.clear()
+            ids = queue(db, Notification, ['before@smtp.test', REFUSED_RECIPIENT, 'after@smtp.test'])
+            dispatch_notifications()
+            rows = statuses(db, Notification, ids)
+            refused = rows[ids[1]]
+            checks.expect('other recipients still delivered',
+                          sorted(tos[0] for tos, _ in handler.messages) == ['after@smtp.test', 'before@smtp.test'])
+            checks.expect('refused row scheduled for retry',
+                          refused.status == 'Pending' and refused.attempts == 1 and '550' in (refused.last_error or ''),
+                          f'{refused.status}, {refused.attempts} attempts, {refused.last_error!r}')
+
+            print("Server down")
+            controller.stop()
+            controller = None
+            ids = queue(db, Notification, [f'down{i}@smtp.test' for i in range(3)])
+            dispatch_notifications()
+            rows = statuses(db, Notification, ids)
+            checks.expect('every row scheduled for retry',
+                          all(row.status == 'Pending' and row.attempts == 1 and row.last_error
+                              for row in rows.values()),
+                          ', '.join(f'{row.status}/{row.attempts}' for row in rows.values()))
+    finally:
+        if controller is not None:
+            controller.stop()
+    return checks.failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50, help='messages in the delivery check (default: 50)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    args = parser.parse_args()
+
+    try:
+        import aiosmtpd  # noqa: F401
+    except ImportError:
+        sys.exit('aiosmtpd is not installed: pip install aiosmtpd')
+
+    workdir, app_copy = prepare_workdir()
+    try:
+        failures = run_checks(app_copy, args.messages)
+    finally:
+        if args.keep:
+            print(f"\nScratch copy kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'All checks passed' if not failures else f'{failures} check(s) failed'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()